@@ -3,7 +3,6 @@
 
 import io
 import os
-import re
 import sys
 import slp
 import signal
@@ -12,8 +11,8 @@ import logging.handlers
 
 from usrv import srv, req
 from pymongo import MongoClient
-from bson.decimal128 import Decimal128
-from slp import sync, node, msg, dbapi
+from slp import sync, node, msg, dbapi, transport, archive, cache, aio, \
+    handlers, tokens
 
 
 def init(name):
@@ -21,19 +20,11 @@ def init(name):
     if len(data) == 0:
         slp.LOG.error("Missing JSON configuration file for %s", name)
         raise Exception("No configuration file found for %s" % name)
-    slp.JSON.update(data)
+    slp.configure(data)
     database_name = slp.JSON['database name']
-    slp.REGEXP = re.compile(slp.JSON["serialized regex"])
-    slp.INPUT_TYPES = slp.JSON.get("input types", {})
-    slp.TYPES_INPUT = dict([v, k] for k, v in slp.INPUT_TYPES.items())
     slp.PUBLIC_IP = req.GET.plain(peer="https://www.ipecho.net").get(
         "raw", slp.get_extern_ip()
     )
-    # update validation field 'tp'
-    slp.VALIDATION["tp"] = lambda value: value in slp.JSON["input types"]
-    # create the SLPN global variables
-    for slp_type in slp.JSON.get("slp types"):
-        setattr(slp, slp_type[1:].upper(), slp_type)
     # initialize logger
     # TODO: add log rotation parameters to slp.json
     slp.LOG.handlers.clear()
@@ -52,14 +43,40 @@ def init(name):
     dbapi.db.rejected.create_index([("height", 1), ("index", 1)], unique=True)
     dbapi.db.slp1.create_index([("address", 1), ("tokenId", 1)], unique=True)
     dbapi.db.slp2.create_index([("address", 1), ("tokenId", 1)], unique=True)
-    # generate Decimal128 builders for all legit slp1 token
-    for reccord in dbapi.db.journal.find(
-        {"tp": "GENESIS", "slp_type": slp.SLP1, "legit": True}
-    ):
-        slp.DECIMAL128[reccord["id"]] = \
-            lambda v, de=reccord.get('de', 0): Decimal128(f"%.{de}f" % v)
+    # contracts not passing field validation are logged in a capped
+    # collection so spam can not grow database
+    if "unvalidated" not in dbapi.db.list_collection_names():
+        dbapi.db.create_collection(
+            "unvalidated", capped=True,
+            size=slp.JSON.get("unvalidated size", 16 * 1024 * 1024)
+        )
+    dbapi.db.unvalidated.create_index("blockStamp")
+    # token decimal places are loaded on demand
+    tokens.REGISTRY.size = slp.JSON.get("token cache size", 4096)
+    tokens.REGISTRY.clear()
+    # integer base units stored next to Decimal128 amounts
+    if slp.JSON.get("integer units", False):
+        slp.LOG.info("%d token units migrated", dbapi.migrate_units())
+        dbapi.db.slp1.create_index([("tokenId", 1), ("balanceUnits", 1)])
+        dbapi.db.contracts.create_index("globalSupplyUnits")
+    # build contract handler registry
+    handlers.load()
     # update peer limit in node module
     node.PEER_LIMIT = slp.JSON.get("peer limit", 10)
+    # update http transport parameters
+    transport.POOL_SIZE = slp.JSON.get("http pool size", 8)
+    transport.TIMEOUT = slp.JSON.get("http timeout", 30)
+    transport.RETRY_RATIO = slp.JSON.get("http retry ratio", 0.1)
+    # cache block transactions on disk if asked
+    if slp.JSON.get("cache size", 0) > 0:
+        sync.chain.CACHE = cache.BlockCache(
+            slp.JSON.get("cache folder", None), slp.JSON["cache size"]
+        )
+    # store parsed blocks in local archive if asked
+    if slp.JSON.get("archive", False):
+        sync.chain.BlockParser.ARCHIVE = archive.Archive(
+            slp.JSON.get("archive folder", None)
+        )
 
 
 def deploy(host="127.0.0.1", port=5200, blockchain="ark"):
@@ -108,17 +125,22 @@ class SlpApp(srv.MicroJsonApp):
         srv.MicroJsonApp.__init__(
             self, host, port, loglevel=options.get("loglevel", 20)
         )
-        sync.Processor()  # --> will start a BlockParser
-        node.Broadcaster()
-        msg.Messenger()
+        if slp.JSON.get("engine", "thread") == "asyncio":
+            aio.Engine()
+        else:
+            sync.Processor()  # --> will start a BlockParser
+            node.Broadcaster()
+            msg.Messenger()
         signal.signal(signal.SIGTERM, SlpApp.kill)
 
     @staticmethod
     def kill(*args, **kwargs):
+        aio.Engine.stop()
         sync.Processor.stop()
         node.Broadcaster.stop()
         msg.Messenger.stop()
         sync.chain.BlockParser.stop()
+        sync.peers.PeerPool.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+
+"""
+Bulk SEND builder benchmark: `serde.pack_slp1` called row by row against
+`serde.pack_slp1_bulk` on an airdrop of `n` recipients.
+
+```sh
+python bench/bulk.py [-n 100000] [--unique-notes]
+```
+"""
+
+import os
+import sys
+import random
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+
+import slp  # noqa: E402
+from slp import serde  # noqa: E402
+
+
+def build_rows(n, unique_notes, seed=0):
+    rnd = random.Random(seed)
+    return [
+        (
+            "A%033x" % rnd.getrandbits(132), rnd.randint(1, 10**6),
+            f"airdrop #{i}" if unique_notes else "airdrop"
+        ) for i in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=100000)
+    parser.add_argument("--unique-notes", action="store_true")
+    args = parser.parse_args()
+
+    slp.configure(slp.loadJson("ark.json"))
+    tokenId = slp.get_token_id("rslp1", "BNDS", 16894251, "4d" * 32)
+    rows = build_rows(args.n, args.unique_notes)
+
+    def one_by_one():
+        return [
+            (recipient, serde.pack_slp1("SEND", tokenId, qt, no=no))
+            for recipient, qt, no in rows
+        ]
+
+    def bulk():
+        return serde.pack_slp1_bulk("SEND", tokenId, rows, de=2)
+
+    assert one_by_one() == bulk()
+    results = {}
+    for name, func in [("pack_slp1", one_by_one), ("bulk", bulk)]:
+        elapsed = min(timeit.repeat(func, number=1, repeat=3))
+        results[name] = args.n / elapsed
+        print("%-10s %12.0f contracts/sec" % (name, results[name]))
+    print("speedup    %12.2fx" % (results["bulk"] / results["pack_slp1"]))
+
+
+if __name__ == "__main__":
+    main()
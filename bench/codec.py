@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+
+"""
+Serde and validation benchmark on the checked-in corpus (see `corpus.py`).
+Reports operations per second and peak memory allocated per operation for
+packing, unpacking, vendor field classification and field validation.
+Results are saved as json so runs can be compared.
+
+```sh
+python bench/codec.py [-r 5] [--save results.json] [--compare old.json]
+```
+"""
+
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+
+import slp  # noqa: E402
+import corpus  # noqa: E402
+from slp import serde  # noqa: E402
+
+
+def operations(data):
+    "return a mapping of benchmarked operation name: list of callables"
+    smartbridges = [
+        vendorField for contract in data["contracts"]
+        for vendorField in contract["vendorFields"]
+    ]
+    fields = [
+        list(serde.unpack_slp(smartbridge).values())[0]
+        for smartbridge in smartbridges
+    ]
+    return {
+        "pack": [
+            (lambda f=getattr(serde, c["packer"]), a=c["args"],
+             k=c["kwargs"]: f(*a, **k))
+            for c in data["contracts"]
+        ],
+        "unpack": [
+            (lambda s=smartbridge: serde.unpack_slp(s))
+            for smartbridge in smartbridges
+        ],
+        "classify": [
+            (lambda v=vendorField: serde.classify(v))
+            for vendorField in smartbridges + data["json"] + data["memos"]
+        ],
+        "validate": [(lambda f=f: slp.validate(**f)) for f in fields],
+    }
+
+
+def speed(calls, repeat):
+    def run():
+        for call in calls:
+            call()
+    elapsed = min(timeit.repeat(run, number=1, repeat=repeat))
+    return len(calls) / elapsed
+
+
+def allocation(calls):
+    "mean of peak memory allocated by a single call, in bytes"
+    total = 0
+    tracemalloc.start()
+    try:
+        for call in calls:
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            call()
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / len(calls)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-n", "--number", type=int, default=2000)
+    parser.add_argument("--save", default=None)
+    parser.add_argument("--compare", default=None)
+    args = parser.parse_args()
+
+    slp.configure(slp.loadJson("ark.json"))
+    results = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "operations": {}
+    }
+    for name, calls in operations(corpus.load()).items():
+        results["operations"][name] = {
+            "items": len(calls),
+            "ops/sec": speed(calls * args.number, args.repeat),
+            "bytes/op": allocation(calls),
+        }
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as in_:
+            previous = json.load(in_)["operations"]
+    for name, result in results["operations"].items():
+        line = "%-10s %12.0f ops/sec %10.0f bytes/op" % (
+            name, result["ops/sec"], result["bytes/op"]
+        )
+        if name in previous:
+            line += "   x%.2f" % (
+                result["ops/sec"] / previous[name]["ops/sec"]
+            )
+        print(line)
+
+    if args.save:
+        with open(args.save, "w") as out:
+            json.dump(results, out, indent=4)
+
+
+if __name__ == "__main__":
+    main()
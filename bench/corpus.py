@@ -0,0 +1,117 @@
+# -*- coding:utf-8 -*-
+
+"""
+Benchmark corpus builder. Contracts below cover every SLP1 and SLP2
+contract type with field values shaped like mainnet ones, and non SLP vendor
+fields are the kind of memos found in ordinary transfers. They are written
+by hand, not recorded from a node, and `corpus.json` is generated from them
+so benchmarks run offline.
+
+VOIDMETA is packed with `pack_slp2_voidmeta` only: its 128 bytes fixed layout
+does not fit the 256 chars of a vendor field.
+
+```sh
+python bench/corpus.py
+```
+"""
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+
+import slp  # noqa: E402
+from slp import serde  # noqa: E402
+
+FOLDER = os.path.abspath(os.path.dirname(__file__))
+TOKEN = slp.get_token_id("rslp1", "BNDS", 16894251, "4d" * 32)
+NFT = slp.get_token_id("rslp2", "ZMB", 16901377, "a3" * 32)
+TXID = "5b1f" * 16
+
+#: (packer, args, kwargs)
+CONTRACTS = [
+    ("pack_slp1", ["GENESIS", 2, 2500000000, "BNDS", "Ark Bonds"], {
+        "du": "ipfs://QmZp5b9bLhJ8i1QzN3Z6w5uC7H8Dd4LaNQq8T4oHk9Kq4j",
+        "no": "bonds issued by delegate", "pa": True, "mi": True
+    }),
+    ("pack_slp1", ["GENESIS", 8, 2100000000000000, "SATS", "Satoshi"], {}),
+    ("pack_slp1", ["BURN", TOKEN, 150000], {"no": "burn 1500 BNDS"}),
+    ("pack_slp1", ["MINT", TOKEN, 2500000], {}),
+    ("pack_slp1", ["SEND", TOKEN, 1250], {"no": "payout #1187"}),
+    ("pack_slp1", ["SEND", TOKEN, 99999999999], {}),
+    ("pack_slp1", ["PAUSE", TOKEN], {}),
+    ("pack_slp1", ["RESUME", TOKEN], {"no": "maintenance over"}),
+    ("pack_slp1", ["NEWOWNER", TOKEN], {}),
+    ("pack_slp1", ["FREEZE", TOKEN], {"no": "court order 2021/17"}),
+    ("pack_slp1", ["UNFREEZE", TOKEN], {}),
+    ("pack_slp2", ["GENESIS", "ZMB", "Zombie Cards"], {
+        "du": "https://zombies.example.com/collection.json", "pa": True
+    }),
+    ("pack_slp2", ["PAUSE", NFT], {}),
+    ("pack_slp2", ["RESUME", NFT], {}),
+    ("pack_slp2", ["NEWOWNER", NFT], {"no": "sold"}),
+    ("pack_slp2", ["AUTHMETA", NFT], {}),
+    ("pack_slp2", ["ADDMETA", NFT], {"rarity": "common"}),
+    ("pack_slp2", ["ADDMETA", NFT], dict(
+        [("trait%02d" % i, "value of trait number %d" % i) for i in range(12)],
+        image="ipfs://QmT5NvUtoM5nWFfrQdVrFtvGfKFmG7AHE8P34isapyhCxX",
+        description="A zombie card from the first season, mint #0042 " * 2
+    )),
+    ("pack_slp2", ["REVOKEMETA", NFT], {}),
+    ("pack_slp2", ["CLONE", NFT], {"no": "season 2"}),
+]
+
+#: json contracts posted before serialization was available
+JSON_CONTRACTS = [
+    {"rslp1": {"tp": "SEND", "id": TOKEN, "qt": "12.5", "no": "json"}},
+    {"rslp2": {"tp": "PAUSE", "id": NFT}},
+]
+
+MEMOS = [
+    "", "tip", "thanks!", "gm", "rent june", "12345678",
+    "payout from delegate biz_classic",
+    "Ark.io exchange withdrawal 5f3a2c9be1",
+    "Vote reward share 85% - block 17902732",
+    "https://ark.io", "rslp is cool", "rslp1 airdrop soon",
+    '{"memo": "not a contract"}', "[1, 2, 3]",
+    "été 2021 ☀", "a" * 255,
+]
+
+
+def build():
+    contracts = []
+    for packer, args, kwargs in CONTRACTS:
+        vendorFields = getattr(serde, packer)(*args, **kwargs)
+        if isinstance(vendorFields, str):
+            vendorFields = [vendorFields]
+        for vendorField in vendorFields:
+            # every serialized contract have to be decodable
+            serde.unpack_slp(vendorField)
+        contracts.append({
+            "packer": packer, "args": args, "kwargs": kwargs,
+            "vendorFields": vendorFields
+        })
+    return {
+        "contracts": contracts,
+        "json": [json.dumps(contract) for contract in JSON_CONTRACTS],
+        "memos": MEMOS
+    }
+
+
+def load():
+    return slp.loadJson("corpus.json", FOLDER)
+
+
+if __name__ == "__main__":
+    slp.configure(slp.loadJson("ark.json"))
+    corpus = build()
+    slp.dumpJson(corpus, "corpus.json", FOLDER)
+    print(
+        "%d contracts (%d smartbridges), %d json contracts and %d memos "
+        "saved" % (
+            len(corpus["contracts"]),
+            sum(len(c["vendorFields"]) for c in corpus["contracts"]),
+            len(corpus["json"]), len(corpus["memos"])
+        )
+    )
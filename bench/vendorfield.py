@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+
+"""
+Vendor field classification micro benchmark: legacy `json.loads` then
+`serde.unpack_slp` exception based reading against `serde.classify` on a mix
+of SLP contracts and ordinary memos.
+
+```sh
+python bench/vendorfield.py [-n 200000] [--slp-ratio 0.05]
+```
+"""
+
+import os
+import sys
+import json
+import random
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "..", "..")))
+
+import slp  # noqa: E402
+from slp import serde  # noqa: E402
+
+MEMOS = [
+    "", "tip", "thanks!", "payout from delegate biz_classic",
+    "Ark.io exchange withdrawal 5f3a2c", "rent june", "gm",
+    '{"memo": "not a contract"}', "https://ark.io", "rslp is cool",
+    "Vote reward share 85% - block 17902732", "12345678",
+]
+
+
+def legacy_read(vendorField):
+    contract = False
+    try:
+        contract = json.loads(vendorField)
+    except Exception:
+        try:
+            contract = serde.unpack_slp(vendorField)
+        except Exception:
+            pass
+    return False or contract
+
+
+def build_mix(n, slp_ratio, seed=0):
+    rnd = random.Random(seed)
+    tokenId = "%032x" % rnd.getrandbits(128)
+    contracts = [
+        serde.pack_slp1("GENESIS", 2, 100000, "TKN", "Token name"),
+        serde.pack_slp1("SEND", tokenId, 1500, no="airdrop"),
+        serde.pack_slp1("BURN", tokenId, 10),
+        serde.pack_slp2("GENESIS", "NFT", "Collection", du="ipfs://Qm1"),
+        serde.pack_slp2("ADDMETA", tokenId, trait="zombie")[0],
+        json.dumps({"rslp1": {"tp": "SEND", "id": tokenId, "qt": "5"}}),
+    ]
+    return [
+        rnd.choice(contracts) if rnd.random() < slp_ratio
+        else rnd.choice(MEMOS) for _ in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200000)
+    parser.add_argument("--slp-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    slp.configure(slp.loadJson("ark.json"))
+    mix = build_mix(args.n, args.slp_ratio)
+    # contracts found by legacy reader have to be found by classifier.
+    # Legacy reader also returns any json value and misses smartbridges
+    # containing a new line because of serialized regex
+    for vendorField in mix:
+        contract = legacy_read(vendorField)
+        if isinstance(contract, dict) and \
+           list(contract)[0] in slp.JSON["slp types"]:
+            assert serde.classify(vendorField).contract == contract
+
+    results = {}
+    for name, func in [("legacy", legacy_read), ("classify", serde.classify)]:
+        elapsed = min(timeit.repeat(
+            lambda: [func(v) for v in mix], number=1, repeat=3
+        ))
+        results[name] = args.n / elapsed
+        print("%-10s %12.0f ops/sec" % (name, results[name]))
+    print("speedup    %12.2fx" % (results["classify"] / results["legacy"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,6 @@ import socket
 import logging
 import hashlib
 
-DECIMAL128 = {}
 INPUT_TYPES = {}
 TYPES_INPUT = {}
 JSON = {}
@@ -19,24 +18,6 @@ LOG = logging.getLogger("slp")
 ROOT = os.path.abspath(os.path.dirname(__file__))
 BLOCKCHAIN_NODE = False
 REGEXP = re.compile(".*")
-VALIDATION = {
-    "id": lambda value: re.match(r"^[0-9a-fA-F]{32}$", value) is not None,
-    "qt": lambda value: isinstance(value, (int, float)),
-    "de": lambda value: 0 <= value <= 8,
-    "sy": lambda value: re.match(r"^[0-9a-zA-Z]{3,8}$", value) is not None,
-    "na": lambda value: re.match(r"^.{3,24}$", value) is not None,
-    "du": lambda value: (value == "") or (
-        re.match(
-            r"(https?|ipfs|ipns|dweb):\/\/[a-z0-9\/:%_+.,#?!@&=-]{3,180}",
-            value
-        )
-    ) is not None,
-    "no": lambda value: re.match(r"^.{0,180}$", value) is not None,
-    "pa": lambda value: value in [True, False, 0, 1],
-    "mi": lambda value: value in [True, False, 0, 1],
-    "ch": lambda value: isinstance(value, int),
-    "dt": lambda value: re.match(r"^.{0,256}$", value) is not None
-}
 HEADERS = {
     "API-Version": "3",
     "Content-Type": "application/json",
@@ -44,12 +25,125 @@ HEADERS = {
 }
 
 
+def configure(data):
+    """
+    Set SLP protocol globals from json configuration.
+    """
+    global REGEXP, INPUT_TYPES, TYPES_INPUT, VALIDATOR
+    JSON.update(data)
+    REGEXP = re.compile(JSON["serialized regex"])
+    INPUT_TYPES = JSON.get("input types", {})
+    TYPES_INPUT = dict([v, k] for k, v in INPUT_TYPES.items())
+    # compile field validator
+    VALIDATOR = Validator(JSON)
+    # create the SLPN global variables
+    for slp_type in JSON.get("slp types"):
+        globals()[slp_type[1:].upper()] = slp_type
+
+
+def _match(pattern):
+    "compile pattern and return a test function"
+    match = re.compile(pattern).match
+    return lambda value: match(value) is not None
+
+
+def _meta(value, match=re.compile(r"^.{0,256}$").match):
+    # serialized ADDMETA contracts carry metadata as a mapping
+    return match(
+        value if isinstance(value, str) else json.dumps(value)
+    ) is not None
+
+
+class Validator(object):
+    """
+    Contract field validator compiled from json configuration (`slp fields`
+    and `input types`). Validation stops on first invalid field and reports
+    field name and reason.
+
+    ```python
+    >>> slp.VALIDATOR.check(tp="SEND", de=12)
+    ('de', 'decimal places out of 0..8 range')
+    ```
+    """
+
+    RULES = {
+        "id": (
+            _match(r"^[0-9a-fA-F]{32}$"), "token id is not 32 hex digits"
+        ),
+        "qt": (
+            lambda value: isinstance(value, (int, float)),
+            "quantity is not a number"
+        ),
+        "de": (
+            lambda value: 0 <= value <= 8, "decimal places out of 0..8 range"
+        ),
+        "sy": (
+            _match(r"^[0-9a-zA-Z]{3,8}$"),
+            "symbol is not 3 to 8 alphanumeric chars"
+        ),
+        "na": (_match(r"^.{3,24}$"), "name is not 3 to 24 chars"),
+        "du": (
+            lambda value, match=_match(
+                r"(https?|ipfs|ipns|dweb):\/\/[a-z0-9\/:%_+.,#?!@&=-]{3,180}"
+            ): value == "" or match(value),
+            "document is not a valid uri"
+        ),
+        "no": (_match(r"^.{0,180}$"), "note is more than 180 chars"),
+        "pa": (
+            lambda value: value in [True, False, 0, 1],
+            "pausable is not a boolean"
+        ),
+        "mi": (
+            lambda value: value in [True, False, 0, 1],
+            "mintable is not a boolean"
+        ),
+        "ch": (lambda value: isinstance(value, int), "chunk is not integer"),
+        "dt": (_meta, "metadata is more than 256 chars"),
+    }
+
+    def __init__(self, data=None):
+        data = {} if data is None else data
+        input_types = frozenset(data.get("input types", {}))
+        rules = dict(
+            Validator.RULES,
+            tp=(lambda value: value in input_types, "unknown contract type")
+        )
+        self.rules = dict(
+            [name, rules[name]]
+            for name in data.get("slp fields", ",".join(rules)).split(",")
+            if name in rules
+        )
+
+    def check(self, **fields):
+        """
+        Returns `None` if all fields are valid else a `(field, reason)`
+        tuple about the first invalid one.
+        """
+        rules = self.rules
+        for name, value in fields.items():
+            rule = rules.get(name, None)
+            if rule is not None:
+                test, reason = rule
+                try:
+                    if not test(value):
+                        return name, reason
+                except Exception:
+                    return name, f"bad value type {type(value).__name__}"
+        return None
+
+    def check_many(self, reccords):
+        "Returns check results of a reccord list"
+        check = self.check
+        return [check(**reccord) for reccord in reccords]
+
+
+VALIDATOR = Validator()
+
+
 def validate(**fields):
-    tests = dict(
-        [k, VALIDATION[k](v)] for k, v in fields.items() if k in VALIDATION
-    )
-    LOG.debug("validation result: %s", tests)
-    return list(tests.values()).count(False) == 0
+    result = VALIDATOR.check(**fields)
+    LOG.debug("validation result: %s", result or "ok")
+    return result is None
 
 
 def get_extern_ip():
@@ -82,8 +176,10 @@ def dumpJson(data, name, folder=None):
         os.makedirs(os.path.dirname(filename))
     except OSError:
         pass
-    with io.open(filename, "w", encoding="utf-8") as out:
+    # write a temporary file and then rename it so file is never corrupted
+    with io.open(filename + ".tmp", "w", encoding="utf-8") as out:
         json.dump(data, out, indent=4)
+    os.replace(filename + ".tmp", filename)
 
 
 def get_token_id(slp_type, symbol, blockheight, txid):
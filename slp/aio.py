@@ -0,0 +1,521 @@
+# -*- coding:utf-8 -*-
+
+"""
+asyncio ingest engine, an alternative to thread based Processor, BlockParser,
+Messenger and Broadcaster. Block paging, transaction download, peer
+prospection, broadcast and webhook handling run on a single event loop using
+keep-alive HTTP connections, so hundreds of requests can be in flight without
+a thread per activity.
+
+Journal registration and contract execution stay synchronous and are run in
+order on a single executor thread. Engine database reads use `motor` if it is
+installed, else pymongo calls are run in that executor.
+
+Engine is used if `engine` is set to `asyncio` in json configuration file.
+"""
+
+import ssl
+import time
+import slp
+import json
+import asyncio
+import threading
+import traceback
+import http.client
+import collections
+import urllib.parse
+
+from slp import dbapi, chain, node, peers, transport, checkpoint
+from concurrent import futures
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+#: running engine
+ENGINE = None
+
+
+class Client:
+    """
+    Minimal asyncio HTTP/1.1 client keeping connections alive per host.
+    """
+
+    def __init__(self, size=8, timeout=30):
+        self.size = size
+        self.timeout = timeout
+        self.idle = collections.defaultdict(list)
+
+    async def _acquire(self, scheme, netloc):
+        idle = self.idle[(scheme, netloc)]
+        if len(idle):
+            return idle.pop(), True
+        host, _, port = netloc.partition(":")
+        port = int(port or (443 if scheme == "https" else 80))
+        conn = await asyncio.open_connection(
+            host, port,
+            ssl=ssl.create_default_context() if scheme == "https" else None
+        )
+        return conn, False
+
+    def _release(self, key, conn):
+        if len(self.idle[key]) < self.size:
+            self.idle[key].append(conn)
+        else:
+            conn[1].close()
+
+    @staticmethod
+    async def _exchange(conn, head, data):
+        reader, writer = conn
+        writer.write(head + data)
+        await writer.drain()
+        line = await reader.readline()
+        if line == b"":
+            raise http.client.RemoteDisconnected(
+                "Remote end closed connection without response"
+            )
+        status = int(line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in [b"\r\n", b"\n", b""]:
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        keep = headers.get("connection", "").lower() != "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            raw = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # skip trailers
+                    while (await reader.readline()) not in [b"\r\n", b""]:
+                        pass
+                    break
+                raw += await reader.readexactly(size)
+                await reader.readline()
+        elif "content-length" in headers:
+            raw = await reader.readexactly(int(headers["content-length"]))
+        else:
+            raw, keep = await reader.read(), False
+        return status, raw, keep
+
+    async def request(
+        self, method, peer, path, params={}, body=None, headers={}
+    ):
+        """
+        Send an HTTP request, response is built as `slp.transport` does.
+        """
+        scheme, netloc = urllib.parse.urlsplit(peer)[:2]
+        url = "/" + path.strip("/")
+        if len(params):
+            url += "?" + urllib.parse.urlencode(params)
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        lines = [
+            f"{method} {url} HTTP/1.1", f"Host: {netloc}",
+            "Connection: keep-alive", f"Content-Length: {len(data)}"
+        ] + [f"{k}: {v}" for k, v in headers.items()]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        while True:
+            conn, reused = None, False
+            try:
+                conn, reused = await asyncio.wait_for(
+                    self._acquire(scheme, netloc), self.timeout
+                )
+                status, raw, keep = await asyncio.wait_for(
+                    self._exchange(conn, head, data), self.timeout
+                )
+            except Exception as error:
+                if conn is not None:
+                    conn[1].close()
+                # a reused connection may have been closed by remote host,
+                # a request with side effect is sent again only if remote
+                # host answered nothing
+                if reused and (
+                    method in ["GET", "HEAD"] or
+                    isinstance(error, http.client.RemoteDisconnected)
+                ):
+                    continue
+                return {"status": -1, "error": "%r" % error}
+            if keep:
+                self._release((scheme, netloc), conn)
+            else:
+                conn[1].close()
+            return transport.load_response(status, raw)
+
+    def close(self):
+        for conns in self.idle.values():
+            for _, writer in conns:
+                writer.close()
+        self.idle.clear()
+
+
+class Database:
+    """
+    Awaitable database reads.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.motor = None
+        if AsyncIOMotorClient is not None:
+            self.motor = AsyncIOMotorClient(
+                slp.JSON.get("mongo url", None)
+            )[slp.JSON["database name"]]
+
+    async def find(self, collection, filter, sort=None, limit=0):
+        if self.motor is not None:
+            cursor = getattr(self.motor, collection).find(filter)
+            if sort is not None:
+                cursor = cursor.sort(sort)
+            return await cursor.limit(limit).to_list(None)
+
+        def _find():
+            cursor = getattr(dbapi.db, collection).find(filter)
+            if sort is not None:
+                cursor = cursor.sort(sort)
+            return list(cursor.limit(limit))
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, _find
+        )
+
+
+class Engine(threading.Thread):
+    """
+    Daemon running the asyncio engine event loop.
+    """
+
+    STOP = threading.Event()
+
+    def __init__(self, *args, **kwargs):
+        global ENGINE
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.loop = None
+        ENGINE = self
+        self.start()
+        slp.LOG.info("Engine %s set", id(self))
+
+    @staticmethod
+    def stop():
+        global ENGINE
+        Engine.STOP.set()
+        ENGINE = None
+        # wake up broadcast relay
+        node.Broadcaster.JOB.put([None, None])
+
+    def put(self, request):
+        """
+        Thread safe webhook or message request push.
+        """
+        if self.loop is None:
+            return False
+        self.loop.call_soon_threadsafe(self.messages.put_nowait, request)
+        return True
+
+    def run(self):
+        Engine.STOP.clear()
+        try:
+            asyncio.run(self.main())
+        except Exception as error:
+            slp.LOG.error("%r\n%s", error, traceback.format_exc())
+        slp.LOG.info("Engine %s clean exit", id(self))
+
+    async def main(self):
+        self.messages = asyncio.Queue()
+        self.blocks = asyncio.Queue(slp.JSON.get("queue size", 100))
+        self.synced = asyncio.Event()
+        self.client = Client(transport.POOL_SIZE, transport.TIMEOUT)
+        # single thread executor sequencing synchronous database work
+        self.executor = futures.ThreadPoolExecutor(max_workers=1)
+        self.db = Database(self.executor)
+        self.loop = asyncio.get_running_loop()
+
+        tasks = [
+            asyncio.create_task(coro) for coro in [
+                self.sync(), self.sequence(), self.listen(), self.relay()
+            ]
+        ]
+        while not Engine.STOP.is_set():
+            await asyncio.sleep(1)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.client.close()
+        await self.run_sync(checkpoint.flush)
+        self.executor.shutdown(wait=False)
+
+    async def run_sync(self, func, *args):
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    # -- peer routing --
+    async def timed_call(self, func, peer, *args, **kwargs):
+        start = time.time()
+        try:
+            result = await func(*args, peer=peer, **kwargs)
+            # connection errors are returned with a negative status
+            if isinstance(result, dict) and \
+               not 200 <= result.get("status", 0) < 300:
+                raise Exception("Bad status %s" % result.get("status"))
+        except Exception:
+            peers.PeerPool.report(peer, time.time() - start, True)
+            raise
+        else:
+            peers.PeerPool.report(peer, time.time() - start)
+            return result
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Await `func(*args, peer=peer, **kwargs)` on best relay peer, hedged
+        to the next best peer the way `PeerPool.call` does.
+        """
+        delay = slp.JSON.get("hedge delay", 2.)
+        ranking = await self.loop.run_in_executor(
+            None, peers.PeerPool.best, 1 + slp.JSON.get("hedged requests", 1)
+        )
+        pending, error = {}, None
+        try:
+            for peer in ranking:
+                pending[asyncio.create_task(
+                    self.timed_call(func, peer, *args, **kwargs)
+                )] = peer
+                while len(pending):
+                    done, _ = await asyncio.wait(
+                        pending, timeout=delay,
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not len(done):
+                        break
+                    for task in done:
+                        peer = pending.pop(task)
+                        if task.exception() is None:
+                            return task.result(), peer
+                        error = task.exception()
+            while len(pending):
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    peer = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result(), peer
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error or Exception("No peer available")
+
+    # -- relay requests --
+    async def get_page(self, page, peer):
+        return await self.client.request(
+            "GET", peer, "api/blocks", params={
+                "page": page, "limit": 100, "orderBy": "height:asc"
+            }, headers=slp.HEADERS
+        )
+
+    async def get_transactions(self, block, peer):
+        count = int(block["transactions"])
+        if chain.CACHE is not None:
+            result = chain.CACHE.get(block["id"], count)
+            if result is not None:
+                return result
+        data, page, result = [None], 1, []
+        while len(data) > 0:
+            data = (
+                await self.client.request(
+                    "GET", peer, f"api/blocks/{block['id']}/transactions",
+                    params={"page": page}, headers=slp.HEADERS
+                )
+            ).get("data", [])
+            result += data
+            page += 1
+        if len(result) != count:
+            raise Exception("Block integrity breach")
+        if chain.CACHE is not None:
+            chain.CACHE.put(block["id"], result)
+        return result
+
+    # -- tasks --
+    async def sync(self):
+        """
+        Walk block pages from last applied block with a look-ahead window.
+        """
+        if not chain.subscribed():
+            await self.run_sync(chain.subscribe)
+        applied = await self.run_sync(checkpoint.load)
+        # execute reccords registered but not applied
+        await self.run_sync(
+            chain.manage_contracts, await self.db.find(
+                "journal", {"legit": None, "height": {"$gt": applied}},
+                [("height", 1), ("index", 1)]
+            )
+        )
+        start_height = max(min(slp.JSON["milestones"].values()), applied)
+        last_reccord = await self.db.find(
+            "journal", {}, [("height", -1)], 1
+        )
+        if len(last_reccord):
+            start_height = max(last_reccord[0]["height"], start_height)
+        slp.LOG.info("Start downloading blocks from height %s", start_height)
+
+        prefetch = max(1, int(slp.JSON.get("prefetch pages", 4)))
+        next_page = start_height // 100 - 1
+        last_parsed = start_height
+        window = collections.deque()
+        while True:
+            while len(window) < prefetch:
+                window.append((next_page, asyncio.create_task(
+                    self.call(self.get_page, next_page)
+                )))
+                next_page += 1
+            page, task = window.popleft()
+            try:
+                resp, peer = await task
+                assert resp.get("status", False) == 200
+            except Exception:
+                slp.LOG.info("No block found for page %d", page)
+                window.appendleft((page, asyncio.create_task(
+                    self.call(self.get_page, page)
+                )))
+                continue
+            blocks = [
+                b for b in resp.get("data", [])
+                if b["transactions"] > 0 and b["height"] > last_parsed
+            ]
+            slp.LOG.info("Fetching %d blocks from page %d", len(blocks), page)
+            for block in blocks:
+                # waits while queue is full
+                await self.blocks.put(block)
+                last_parsed = block["height"]
+            if resp.get("meta", {}).get("next", False) is None:
+                slp.LOG.info("End of block pages reached")
+                for _, task in window:
+                    task.cancel()
+                break
+        self.synced.set()
+
+    async def sequence(self):
+        """
+        Download block transactions concurrently and apply blocks in order.
+        """
+        workers = max(1, int(slp.JSON.get("fetch workers", 4)))
+        window = collections.deque()
+        while True:
+            while len(window) < workers:
+                if len(window):
+                    try:
+                        block = self.blocks.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                else:
+                    block = await self.blocks.get()
+                if "numberOfTransactions" in block:
+                    block["transactions"] = block["numberOfTransactions"]
+                window.append((block, asyncio.create_task(
+                    self.call(self.get_transactions, block)
+                )))
+            block, task = window[0]
+            try:
+                tx_list, _ = await task
+            except Exception:
+                slp.LOG.error(
+                    "Downloading again block %d, not enough transaction "
+                    "found", block["height"]
+                )
+                window[0] = (block, asyncio.create_task(
+                    self.call(self.get_transactions, block)
+                ))
+                continue
+            try:
+                applied = await self.run_sync(self.commit, block, tx_list)
+            except Exception as error:
+                slp.LOG.error("%r\n%s", error, traceback.format_exc())
+                applied = None
+            if applied is None:
+                # block stays unapplied and checkpoint is not moved, its
+                # journal reccords are executed again on restart
+                slp.LOG.error(
+                    "Block %d not applied, stopping engine", block["height"]
+                )
+                Engine.stop()
+                return
+            window.popleft()
+
+    @staticmethod
+    def commit(block, tx_list):
+        "apply a block, returns None if it is not written"
+        return chain.BlockParser.apply(
+            chain.BlockParser.register(
+                chain.BlockParser.decode((block, tx_list))
+            )
+        )
+
+    async def listen(self):
+        """
+        Manage webhook and message requests.
+        """
+        while True:
+            request = await self.messages.get()
+            try:
+                data = request.get("data", {})
+                # webhook data is {"timestamp", "event", "data"}
+                if "event" in data:
+                    if self.synced.is_set():
+                        block = chain.read_webhook(**request)
+                        if block is not False:
+                            await self.blocks.put(block)
+                    else:
+                        slp.LOG.info(
+                            "Waiting for blochain sync, "
+                            "webhooh request dropped:\n%s", request
+                        )
+                elif "hello" in data:
+                    slp.LOG.info("Performing message: %r", data)
+                    await self.prospect_peers(data["hello"]["peer"])
+                    slp.LOG.info("discovered peers: %s", len(node.PEERS))
+            except Exception as error:
+                slp.LOG.error("%r\n%s", error, traceback.format_exc())
+
+    async def prospect_peers(self, *candidates):
+        """
+        Recursive peer prospection, see `slp.node.prospect_peers`.
+        """
+        if len(node.PEERS) > node.PEER_LIMIT:
+            return
+        me = f"http://{slp.PUBLIC_IP}:{slp.PORT}"
+        new = set(candidates) - set([me]) - node.PEERS
+        responses = await asyncio.gather(*[
+            self.client.request("GET", peer, "peers") for peer in new
+        ])
+        for peer, resp in zip(new, responses):
+            if resp.get("status", -1) == 200:
+                node.PEERS.update([peer])
+                peer_s_peer = set(resp.get("result", []))
+                # if peer is missing some known peer from here
+                if len(node.PEERS - peer_s_peer):
+                    await self.client.request(
+                        "POST", peer, "message",
+                        body={"hello": {"peer": me}}
+                    )
+                await self.prospect_peers(*(peer_s_peer - node.PEERS))
+
+    async def relay(self):
+        """
+        Send messages queued with `slp.node.Broadcaster.broadcast`.
+        """
+        while True:
+            endpoint, msg, *targets = await self.loop.run_in_executor(
+                None, node.Broadcaster.JOB.get
+            )
+            if endpoint is None:
+                continue
+            await asyncio.gather(*[
+                self.client.request(
+                    endpoint.method, peer, endpoint.path, body=msg
+                ) for peer in targets or node.PEERS
+            ])
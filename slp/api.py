@@ -17,6 +17,7 @@ from pymongo import MongoClient
 
 DECIMAL128_FIELDS = "balance,minted,burned,exited,globalSupply".split(",")
 OPERATOR_FIELDS = "balance,minted,burned,exited,globalSupply,qt".split(",")
+UNIT_FIELDS = [f"{field}Units" for field in DECIMAL128_FIELDS]
 SEARCH_FIELDS = "address,tokenId,blockStamp,owner,frozen," \
                 "slp_type,emitter,receiver,legit,tp,sy,id,pa,mi," \
                 "height,index,type,paused,symbol".split(",")
@@ -48,6 +49,18 @@ def find(collection, **kw):
         if expr != {}:
             filters["$expr"] = expr
 
+        # integer base units are compared as stored so indexes can be used:
+        # balanceUnits=gte:1000,lt:5000 or balanceUnits=1000
+        for field, value in [
+            (f, v) for f, v in kw.items() if f in UNIT_FIELDS
+        ]:
+            filters[field] = dict(
+                [f"${op}", int(value)] for op, value in [
+                    cond.split(":") if ":" in cond else ("eq", cond)
+                    for cond in value.split(",")
+                ]
+            )
+
         # convert bool values
         for key in [
             k for k in ["owner", "frozen", "paused", "legit", "pa", "mi"]
@@ -0,0 +1,158 @@
+# -*- coding:utf-8 -*-
+
+"""
+Local block archive. It stores blocks seen by the node with their type-0
+transactions having a vendor field so database can be rebuilt without any
+network access.
+
+Archive is a folder containing two append-only files:
+
+  - `blocks.arc`: sequence of frames `<QI` (height, size) followed by zlib
+    compressed JSON `{"block": header, "txs": [[index, transaction], ...]}`
+  - `blocks.idx`: sequence of `<QQ` (height, frame offset) entries
+
+Blocks are appended in ascending height order so index can be searched by
+height.
+"""
+
+import os
+import slp
+import json
+import zlib
+import array
+import struct
+import bisect
+import threading
+
+from slp import chain, checkpoint
+
+FRAME = struct.Struct("<QI")
+ENTRY = struct.Struct("<QQ")
+BLOCK_FIELDS = ["id", "height", "transactions"]
+TX_FIELDS = ["id", "type", "sender", "recipient", "amount", "vendorField"]
+
+
+class Archive:
+
+    def __init__(self, folder=None):
+        self.folder = folder or os.path.join(
+            slp.ROOT, ".archive", slp.JSON["database name"]
+        )
+        os.makedirs(self.folder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.heights = array.array("Q")
+        self.offsets = array.array("Q")
+        self._recover()
+
+    @property
+    def arcname(self):
+        return os.path.join(self.folder, "blocks.arc")
+
+    @property
+    def idxname(self):
+        return os.path.join(self.folder, "blocks.idx")
+
+    @property
+    def last_height(self):
+        return self.heights[-1] if len(self.heights) else 0
+
+    def _recover(self):
+        # load index and drop entries pointing to incomplete frames, then
+        # truncate both files after the last complete frame
+        size = os.path.getsize(self.arcname) \
+            if os.path.exists(self.arcname) else 0
+        end = 0
+        # without archive file, index is truncated to 0
+        if size and os.path.exists(self.idxname):
+            with open(self.idxname, "rb") as idx, \
+                 open(self.arcname, "rb") as arc:
+                raw = idx.read()
+                for n in range(len(raw) // ENTRY.size):
+                    height, offset = ENTRY.unpack_from(raw, n * ENTRY.size)
+                    # frames are contiguous and heights are increasing
+                    if offset != end or height <= self.last_height:
+                        break
+                    arc.seek(offset)
+                    header = arc.read(FRAME.size)
+                    if len(header) < FRAME.size:
+                        break
+                    _, length = FRAME.unpack(header)
+                    if offset + FRAME.size + length > size:
+                        break
+                    self.heights.append(height)
+                    self.offsets.append(offset)
+                    end = offset + FRAME.size + length
+        for filename, length in [
+            (self.arcname, end), (self.idxname, len(self) * ENTRY.size)
+        ]:
+            with open(filename, "ab") as out:
+                out.truncate(length)
+
+    def __len__(self):
+        return len(self.heights)
+
+    def append(self, block, txs):
+        """
+        Append a block and its `(index, transaction)` list. Block is ignored
+        if not higher than the last archived one.
+        """
+        with self.lock:
+            if block["height"] <= self.last_height:
+                return False
+            payload = zlib.compress(
+                json.dumps(
+                    {
+                        "block": dict(
+                            [k, block[k]] for k in BLOCK_FIELDS if k in block
+                        ),
+                        "txs": [
+                            [i, dict(
+                                [k, tx[k]] for k in TX_FIELDS if k in tx
+                            )] for i, tx in txs
+                        ]
+                    }, separators=(",", ":")
+                ).encode("utf-8")
+            )
+            with open(self.arcname, "ab") as arc:
+                offset = arc.tell()
+                arc.write(FRAME.pack(block["height"], len(payload)))
+                arc.write(payload)
+            with open(self.idxname, "ab") as idx:
+                idx.write(ENTRY.pack(block["height"], offset))
+            self.heights.append(block["height"])
+            self.offsets.append(offset)
+            return True
+
+    def read(self, start=0, stop=None):
+        """
+        Iterate over archived `(block, [(index, transaction), ...])` with
+        height from `start` to `stop` included.
+        """
+        n = bisect.bisect_left(self.heights, start)
+        stop = self.last_height if stop is None else stop
+        with open(self.arcname, "rb") as arc:
+            while n < len(self) and self.heights[n] <= stop:
+                arc.seek(self.offsets[n])
+                _, length = FRAME.unpack(arc.read(FRAME.size))
+                data = json.loads(zlib.decompress(arc.read(length)))
+                yield data["block"], [tuple(e) for e in data["txs"]]
+                n += 1
+
+
+def replay(folder=None, start=0, stop=None):
+    """
+    Register and execute contracts from archived blocks, the same way
+    BlockParser does with downloaded ones.
+    """
+    count = 0
+    for block, txs in Archive(folder).read(start, stop):
+        candidates = [
+            (index, tx, chain.read_vendorField(tx["vendorField"]))
+            for index, tx in txs
+        ]
+        chain.manage_contracts(chain.register_contracts(block, candidates))
+        checkpoint.update(block["height"])
+        count += 1
+    checkpoint.flush()
+    slp.LOG.info("%d blocks replayed from archive", count)
+    return count
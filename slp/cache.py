@@ -0,0 +1,89 @@
+# -*- coding:utf-8 -*-
+
+"""
+Read-through disk cache for block transactions. Entries are gzipped JSON
+files named after block id, total size is bounded and least recently used
+entries are evicted first.
+"""
+
+import os
+import slp
+import gzip
+import json
+import threading
+import collections
+
+
+class BlockCache:
+
+    def __init__(self, folder=None, size=256 * 1024 * 1024):
+        self.folder = folder or os.path.join(
+            slp.ROOT, ".cache", slp.JSON["database name"]
+        )
+        os.makedirs(self.folder, exist_ok=True)
+        self.size = size
+        self.total = 0
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        # block id -> file size, from least to most recently used
+        self.entries = collections.OrderedDict()
+        for entry in sorted(
+            [e for e in os.scandir(self.folder) if e.name.endswith(".gz")],
+            key=lambda e: e.stat().st_mtime
+        ):
+            self.entries[entry.name[:-3]] = entry.stat().st_size
+            self.total += entry.stat().st_size
+        self._evict()
+
+    def _filename(self, blockId):
+        return os.path.join(self.folder, f"{blockId}.gz")
+
+    def _drop(self, blockId):
+        self.total -= self.entries.pop(blockId, 0)
+        try:
+            os.remove(self._filename(blockId))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self.total > self.size and len(self.entries):
+            self._drop(next(iter(self.entries)))
+
+    def get(self, blockId, count):
+        """
+        Return cached transactions if exactly `count` are stored else `None`.
+        """
+        with self.lock:
+            if blockId not in self.entries:
+                self.misses += 1
+                return None
+            try:
+                with gzip.open(self._filename(blockId), "rb") as in_:
+                    tx_list = json.loads(in_.read())
+                assert len(tx_list) == count
+            except Exception:
+                self._drop(blockId)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(blockId)
+            os.utime(self._filename(blockId))
+            self.hits += 1
+            return tx_list
+
+    def put(self, blockId, tx_list):
+        filename = self._filename(blockId)
+        with gzip.open(filename + ".tmp", "wb") as out:
+            out.write(json.dumps(tx_list, separators=(",", ":")).encode())
+        with self.lock:
+            os.replace(filename + ".tmp", filename)
+            self.total -= self.entries.pop(blockId, 0)
+            self.entries[blockId] = os.path.getsize(filename)
+            self.total += self.entries[blockId]
+            self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries), "bytes": self.total,
+                "hits": self.hits, "misses": self.misses
+            }
@@ -32,43 +32,27 @@ dt|data|string
 """
 
 import os
-import sys
 import slp
-import json
 import queue
-import random
 import pickle
 import hashlib
-import importlib
 import traceback
 import threading
 
-from slp import serde, dbapi
+from slp import serde, dbapi, peers, transport, checkpoint, pipeline, \
+    handlers
+from slp.contract import Contract
 from usrv import req
 
+#: slp.cache.BlockCache instance to be initialized by slp app
+CACHE = None
+
 
 def select_peers():
-    peers = []
-    try:
-        # here candadates is at least [slp.JSON["api peer"]], so if default api
-        # peer does not respond, it should loop until api peer is back
-        candidates = req.GET.api.peers(
-            peer=slp.JSON["api peer"], orderBy="height:desc",
-            headers=slp.HEADERS
-        ).get("data", [slp.JSON["api peer"]])
-    except Exception:
-        # in case of any HTTP error set peers to [slp.JSON["api peer"]]
-        slp.LOG.error("Can not fetch peers from %s", slp.JSON["api peer"])
-        peers = [slp.JSON["api peer"]]
-    else:
-        for candidate in candidates[:20]:
-            api_port = candidate.get("ports", {}).get(
-                "@arkecosystem/core-api", -1
-            )
-            if api_port > 0:
-                peers.append("http://%s:%s" % (candidate["ip"], api_port))
-    finally:
-        return peers
+    """
+    Return best relay peers according to peer pool health scores.
+    """
+    return peers.PeerPool.best(20)
 
 
 def subscribed():
@@ -184,33 +168,38 @@ def check_webhook_token(authorization):
         ).hexdigest() == data["hash"]
 
 
-def get_block_transactions(blockId, peer=None):
+def get_block_transactions(blockId, peer=None, count=None):
+    """
+    Get all transactions from a block. If a transaction count is given,
+    cache is used and filled with complete transaction lists.
+    """
+    if CACHE is not None and count is not None:
+        result = CACHE.get(blockId, count)
+        if result is not None:
+            return result
     data, page, result = [None], 1, []
     peer = peer or slp.JSON["api peer"]
     while len(data) > 0:
-        data = req.GET.api.blocks(
+        data = transport.GET.api.blocks(
             blockId, "transactions", page=page, peer=peer, headers=slp.HEADERS
         ).get("data", [])
         result += data
         page += 1
+    if CACHE is not None and len(result) == count:
+        CACHE.put(blockId, result)
     return result
 
 
 def read_vendorField(vendorField):
-    contract = False
-    try:
-        contract = json.loads(vendorField)
-    except Exception:
-        try:
-            contract = serde.unpack_slp(vendorField)
-        except Exception:
-            pass
-    return False or contract
+    """
+    Return contract from vendor field, `False` if not a SLP contract.
+    """
+    return serde.classify(vendorField).contract
 
 
-def manage_block(**request):
+def read_webhook(**request):
     """
-    Dispatch webhook request.
+    Check webhook request and return block header, `False` if check fails.
     """
     # webhook security check
     auth = request.get("headers", {}).get("authorization", "?")
@@ -224,83 +213,157 @@ def manage_block(**request):
     body = request.get("data", {})
     block = body.get("data", {})
     slp.LOG.info("Genuine block header received:\n%s", block)
+    return block
+
+
+def manage_block(**request):
+    """
+    Dispatch webhook request.
+    """
+    block = read_webhook(**request)
+    if block is False:
+        return False
     # push block into queue to be parsed
     BlockParser.JOB.put(block)
 
 
-def parse_block(block, peer=None):
+def fetch_block(block, peer=None):
     """
-    Search valid SLP vendor fields in all transactions from specified block.
-    If any, it is normalized and registered as a rreccord in journal.
+    Download all transactions from specified block.
     """
-    # contracts to be returned
-    contracts = []
-    # get transactions from block
-    tx_list = get_block_transactions(block["id"], peer)
+    tx_list = get_block_transactions(
+        block["id"], peer, int(block["transactions"])
+    )
     # because at some point, peer could return nothing good, check the
-    # transaction count, AssertionError will be managed by BlockParser
+    # transaction count, exception will be managed by BlockParser
     try:
         assert len(tx_list) == int(block["transactions"])
     except AssertionError:
         slp.LOG.error("Can't retrieve all transactions from block %s", block)
         raise Exception("Block integrity breach")
+    return tx_list
+
+
+def decode_block(tx_list):
+    """
+    Decode SLP vendor fields from a block transaction list. Returns a list of
+    `(index, transaction, contract)` tuples for all transfer transactions
+    with a vendor field, `contract` is `False` if vendor field is not a SLP
+    contract.
+    """
     loop = zip(list(range(len(tx_list))), tx_list)
     # search for SLP vendor fields in transfer type transactions
-    for index, tx in [
-        (i+1, t) for i, t in loop
+    return [
+        (i+1, t, read_vendorField(t["vendorField"])) for i, t in loop
         if t["type"] == 0 and
         t.get("vendorField", "") != ""
-    ]:
-        # try to read contract from vendor field
-        contract = read_vendorField(tx["vendorField"])
-        if contract:
+    ]
+
+
+def read_block(block, peer=None):
+    """
+    Download transactions from specified block and decode SLP vendor fields.
+    It does not touch the database so it can be run concurrently for many
+    blocks.
+    """
+    return decode_block(fetch_block(block, peer))
+
+
+def register_contracts(block, candidates):
+    """
+    Normalize contracts found by `read_block` and register them as reccords
+    in journal. Candidates have to be given in block index order.
+    """
+    # contracts to be returned
+    contracts = []
+    for index, tx, contract in [c for c in candidates if c[-1]]:
+        try:
+            slp_type, fields = list(contract.items())[0]
+            slp.LOG.info(
+                "> SLP contract found: %s->%s", slp_type, fields["tp"]
+            )
+            # compute token id for GENESIS contracts
+            if fields["tp"] == "GENESIS":
+                fields.update(id=slp.get_token_id(
+                    slp_type, fields["sy"], block["height"], tx["id"]
+                ))
+            # add wallet informations and cost
+            fields.update(
+                emitter=tx["sender"], receiver=tx["recipient"],
+                cost=int(tx["amount"])
+            )
+            # tweak numeric values
+            if "de" in fields:
+                fields["de"] = int(fields["de"])
+            if "qt" in fields:
+                fields["qt"] = float(fields["qt"])
+            # add a new reccord in journal
+            contract = dbapi.add_reccord(
+                block["height"], index, tx["id"], slp_type, **fields
+            )
+        except Exception as error:
+            slp.LOG.error(
+                "Error occured with tx %s in block %d",
+                tx["id"], block["height"]
+            )
+            slp.LOG.debug("%r\n%s", error, traceback.format_exc())
+        else:
+            # because dbapi.add_reccord could return False or None if
+            # reccord impossible do store in database
+            if contract not in [None, False]:
+                contracts.append(contract)
+    return contracts
+
+
+def parse_block(block, peer=None):
+    """
+    Search valid SLP vendor fields in all transactions from specified block.
+    If any, it is normalized and registered as a rreccord in journal.
+    """
+    return register_contracts(block, read_block(block, peer))
+
+
+def manage_contracts(contracts):
+    """
+    Execute contracts with handlers registered for their SLP type and
+    contract type. Journal documents are converted to `Contract` reccords.
+    Database reads and writes go through a write-behind block state and are
+    flushed once all contracts are executed, flush errors are raised. Writes
+    of a contract raising an exception are dropped.
+    """
+    with dbapi.block_state() as state:
+        for contract in contracts:
+            if not isinstance(contract, Contract):
+                contract = Contract.from_bson(contract)
+            savepoint = state.savepoint()
             try:
-                slp_type, fields = list(contract.items())[0]
-                slp.LOG.info(
-                    "> SLP contract found: %s->%s", slp_type, fields["tp"]
-                )
-                # compute token id for GENESIS contracts
-                if fields["tp"] == "GENESIS":
-                    fields.update(id=slp.get_token_id(
-                        slp_type, fields["sy"], block["height"], tx["id"]
-                    ))
-                # add wallet informations and cost
-                fields.update(
-                    emitter=tx["sender"], receiver=tx["recipient"],
-                    cost=int(tx["amount"])
-                )
-                # tweak numeric values
-                if "de" in fields:
-                    fields["de"] = int(fields["de"])
-                if "qt" in fields:
-                    fields["qt"] = float(fields["qt"])
-                # add a new reccord in journal
-                contract = dbapi.add_reccord(
-                    block["height"], index, tx["id"], slp_type, **fields
-                )
+                handlers.execute(contract)
             except Exception as error:
-                slp.LOG.error(
-                    "Error occured with tx %s in block %d",
-                    tx["id"], block["height"]
-                )
-                slp.LOG.debug("%r\n%s", error, traceback.format_exc())
-            else:
-                # because dbapi.add_reccord could return False or None if
-                # reccord impossible do store in database
-                if contract not in [None, False]:
-                    contracts.append(contract)
-    return contracts
+                slp.LOG.error("%r\n%s", error, traceback.format_exc())
+                state.rollback(savepoint)
 
 
 class BlockParser(threading.Thread):
+    """
+    Blocks are processed through a pipeline of four stages: transaction
+    download (`fetch workers`), vendor field decoding (`decode workers`),
+    journal registration and contract execution. Registration and execution
+    run on a single worker so (height, index) order is kept. All stage queues
+    and BlockParser queue are bounded (`stage queue size` and `queue size`)
+    so a slow stage blocks block producers.
+    """
 
     JOB = queue.Queue()
     LOCK = threading.Lock()
     STOP = threading.Event()
+    #: slp.archive.Archive instance to store parsed blocks
+    ARCHIVE = None
+    PIPELINE = None
 
     def __init__(self, *args, **kwargs):
         threading.Thread.__init__(self)
         self.daemon = True
+        BlockParser.JOB.maxsize = slp.JSON.get("queue size", 100)
         self.start()
         slp.LOG.info("BlockParser %s set", id(self))
 
@@ -309,59 +372,105 @@ class BlockParser(threading.Thread):
         if BlockParser.LOCK.locked():
             BlockParser.LOCK.release()
         BlockParser.STOP.set()
-        BlockParser.JOB.put(None)
+        if BlockParser.PIPELINE is not None:
+            BlockParser.PIPELINE.stop()
+        try:
+            BlockParser.JOB.put_nowait(None)
+        except queue.Full:
+            pass
+
+    @staticmethod
+    def stats():
+        result = {"queue": BlockParser.JOB.qsize()}
+        if BlockParser.PIPELINE is not None:
+            result.update(BlockParser.PIPELINE.stats())
+        return result
+
+    @staticmethod
+    def fetch(block):
+        while not BlockParser.STOP.is_set():
+            try:
+                tx_list, peer = peers.PeerPool.call(fetch_block, block)
+            except Exception:
+                slp.LOG.error(
+                    "Downloading again block %d, not enough transaction "
+                    "found", block["height"]
+                )
+            else:
+                return block, tx_list
+
+    @staticmethod
+    def decode(item):
+        block, tx_list = item
+        return block, decode_block(tx_list)
+
+    @staticmethod
+    def register(item):
+        block, candidates = item
+        if BlockParser.ARCHIVE is not None:
+            BlockParser.ARCHIVE.append(
+                block, [(i, tx) for i, tx, _ in candidates]
+            )
+        slp.LOG.info(
+            "Parsing %d transaction(s) from block %s",
+            block["transactions"], block["height"]
+        )
+        # atomic action starts here ---
+        BlockParser.LOCK.acquire()
+        try:
+            contracts = register_contracts(block, candidates)
+        finally:
+            if BlockParser.LOCK.locked():
+                BlockParser.LOCK.release()
+        # atomic action is stopped for sure ---
+        return block, contracts
+
+    @staticmethod
+    def apply(item):
+        block, contracts = item
+        try:
+            manage_contracts(contracts)
+        except Exception as error:
+            # block is not written, parsing stops so checkpoint stays on
+            # previous block and its reccords are executed again on restart
+            slp.LOG.error(
+                "Block %d not applied, stopping: %r", block["height"], error
+            )
+            slp.LOG.debug("traceback data:\n%s", traceback.format_exc())
+            BlockParser.stop()
+            return None
+        checkpoint.update(block["height"])
+        return block
 
     def run(self):
-        peers = select_peers()
-        peer = random.choice(peers)
+        size = slp.JSON.get("stage queue size", 16)
+        BlockParser.PIPELINE = pipeline.Pipeline(
+            (
+                "fetch", BlockParser.fetch,
+                slp.JSON.get("fetch workers", 4), size
+            ),
+            (
+                "decode", BlockParser.decode,
+                slp.JSON.get("decode workers", 1), size
+            ),
+            ("journal", BlockParser.register, 1, size),
+            ("apply", BlockParser.apply, 1, size)
+        ).start()
+
         BlockParser.STOP.clear()
         while not BlockParser.STOP.is_set():
-            # atomic action starts here ---
-            block = BlockParser.JOB.get()
+            try:
+                block = BlockParser.JOB.get(timeout=1)
+            except queue.Empty:
+                continue
             if block is not None:
-                BlockParser.LOCK.acquire()
                 # homogenize diff between api data and webhook data because
                 # both are pushing blocks to BlockParser JOB
                 if "numberOfTransactions" in block:
                     block["transactions"] = block["numberOfTransactions"]
-                slp.LOG.info(
-                    "Parsing %d transaction(s) from block %s",
-                    block["transactions"], block["height"]
-                )
-                try:
-                    contracts = parse_block(block, peer)
-                except Exception:
-                    slp.LOG.error(
-                        "Pushing back block %d, not enough transaction found",
-                        block["height"]
-                    )
-                    # put the block to the left of queue to be sure it will be
-                    # get first on BlockParser LOCK release
-                    with BlockParser.JOB.mutex:
-                        BlockParser.JOB.queue.appendleft(block)
-                    if peer in peers:
-                        peers.remove(peer)
-                    if len(peers) <= 1:
-                        peers = select_peers()
-                    peer = random.choice(peers)
-                    BlockParser.LOCK.release()
-                else:
-                    BlockParser.LOCK.release()
-                    # atomic action is stopped for sure ---
-                    for contract in contracts:
-                        module = f"slp.{contract['slp_type'][1:]}"
-                        try:
-                            if module not in sys.modules:
-                                importlib.__import__(module)
-                            sys.modules[module].manage(contract)
-                        except ImportError:
-                            slp.LOG.info(
-                                "No modules found to handle '%s' contracts",
-                                contract['slp_type']
-                            )
-                        except Exception as error:
-                            slp.LOG.error(
-                                "%r\n%s", error, traceback.format_exc()
-                            )
-            else:
-                slp.LOG.info("BlockParser %s clean exit", id(self))
+                # blocks while pipeline is full
+                BlockParser.PIPELINE.put(block)
+
+        BlockParser.PIPELINE.stop()
+        checkpoint.flush()
+        slp.LOG.info("BlockParser %s clean exit", id(self))
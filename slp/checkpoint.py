@@ -0,0 +1,65 @@
+# -*- coding:utf-8 -*-
+
+"""
+Sync checkpoint. It records the height of the last block applied by
+BlockParser so sync can resume exactly where it stopped. Writes are coalesced
+every `checkpoint blocks` blocks or `checkpoint delay` seconds and mark file
+is replaced atomically.
+"""
+
+import os
+import slp
+import time
+import threading
+
+#: last applied block mark
+MARK = {}
+LOCK = threading.Lock()
+#: blocks applied since last write and last write time
+PENDING = 0
+WRITTEN = 0.
+
+
+def markname():
+    return f"{slp.JSON['database name']}.mark"
+
+
+def markfolder():
+    return os.path.join(slp.ROOT, ".json")
+
+
+def load():
+    """
+    Load mark from disk and return last applied height.
+    """
+    with LOCK:
+        MARK.clear()
+        MARK.update(slp.loadJson(markname(), markfolder()))
+        return MARK.get("last applied block", 0)
+
+
+def flush():
+    """
+    Write mark on disk if blocks were applied since last write.
+    """
+    global PENDING, WRITTEN
+    with LOCK:
+        if PENDING > 0:
+            slp.dumpJson(dict(MARK), markname(), markfolder())
+            PENDING, WRITTEN = 0, time.time()
+
+
+def update(height):
+    """
+    Set last applied height and write mark when due.
+    """
+    global PENDING
+    with LOCK:
+        if height <= MARK.get("last applied block", 0):
+            return
+        MARK["last applied block"] = height
+        PENDING += 1
+        due = PENDING >= slp.JSON.get("checkpoint blocks", 100) or \
+            time.time() - WRITTEN >= slp.JSON.get("checkpoint delay", 10)
+    if due:
+        flush()
@@ -0,0 +1,111 @@
+# -*- coding:utf-8 -*-
+
+"""
+Contract reccord. A contract is stored in slots from its registration in
+journal to its execution, it is converted to a dictionary only when sent to
+mongo database. Fields can be read as attributes or mapping items, unset
+fields behave as missing keys. Values read from mongo are converted to the
+declared field types, so `qt` stored as Decimal128 by older journals is a
+float.
+"""
+
+#: journal fields and their types
+JOURNAL = (
+    ("height", int), ("index", int), ("txid", str), ("slp_type", str),
+    ("emitter", str), ("receiver", str), ("cost", int), ("legit", bool),
+)
+#: SLP contract fields and their types
+SLP = (
+    ("tp", str), ("id", str), ("de", int), ("qt", float), ("sy", str),
+    ("na", str), ("du", str), ("no", str), ("pa", bool), ("mi", bool),
+    ("ch", int), ("dt", dict),
+)
+
+
+class Contract(object):
+
+    FIELDS = tuple(name for name, _ in JOURNAL + SLP)
+    TYPES = dict(JOURNAL + SLP)
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        if key not in Contract.TYPES:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in Contract.TYPES and hasattr(self, key)
+
+    def __iter__(self):
+        return (key for key in Contract.FIELDS if hasattr(self, key))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        if isinstance(other, (Contract, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return "Contract(%s)" % ", ".join(
+            "%s=%r" % item for item in self.items()
+        )
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in Contract.TYPES \
+            else default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [getattr(self, key) for key in self]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self]
+
+    @property
+    def blockstamp(self):
+        return f"{self.height}#{self.index}"
+
+    @property
+    def key(self):
+        "journal unique key"
+        return {"height": self.height, "index": self.index}
+
+    def to_bson(self):
+        return dict(self.items())
+
+    @staticmethod
+    def _coerce(key, value):
+        "convert a value to the declared field type, None is kept"
+        kind = Contract.TYPES[key]
+        if value is None or type(value) is kind:
+            return value
+        if hasattr(value, "to_decimal"):
+            # Decimal128 values
+            value = value.to_decimal()
+        return kind(value)
+
+    @staticmethod
+    def from_bson(document):
+        """
+        Build a contract from a mongo document, unknown fields are dropped
+        and values are converted to declared types.
+        """
+        contract = Contract()
+        for key, value in document.items():
+            if key in Contract.TYPES:
+                setattr(contract, key, Contract._coerce(key, value))
+        return contract
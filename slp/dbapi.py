@@ -1,17 +1,209 @@
 # -*- coding:utf-8 -*-
 
-import os
 import slp
 import decimal
+import threading
 import traceback
+import contextlib
+
+from bson import Decimal128, Int64
+from slp import tokens
+from slp.state import BlockState
+from slp.contract import Contract
 
 # mongo database to be initialized by slp app
 db = None
+# write-behind block state of current thread, see slp.state
+LOCAL = threading.local()
+#: Decimal128 amounts, `<field>Units` integer base units are stored next to
+#: them if `integer units` is enabled
+UNIT_FIELDS = ("balance", "minted", "burned", "exited", "globalSupply")
+
+
+@contextlib.contextmanager
+def block_state():
+    """
+    Route contract and wallet reads and writes of current thread through a
+    write-behind state. Pending writes are flushed on exit.
+    """
+    state = getattr(LOCAL, "state", None)
+    if state is not None:
+        # already in a block state
+        yield state
+        return
+    LOCAL.state = state = BlockState(db)
+    try:
+        yield state
+        # nothing is written if block raised
+        state.flush()
+    finally:
+        LOCAL.state = None
+
+
+def _find_one(collection, filter):
+    state = getattr(LOCAL, "state", None)
+    if state is not None:
+        return state.find_one(collection, filter)
+    return getattr(db, collection).find_one(filter)
+
+
+def _find(collection, filter):
+    state = getattr(LOCAL, "state", None)
+    if state is not None:
+        return state.find(collection, filter)
+    return list(getattr(db, collection).find(filter))
+
+
+def _insert_one(collection, document):
+    state = getattr(LOCAL, "state", None)
+    if state is not None:
+        return state.insert_one(collection, document)
+    getattr(db, collection).insert_one(document)
+    return True
+
+
+def _update_one(collection, filter, values, dirty=True):
+    state = getattr(LOCAL, "state", None)
+    if state is not None:
+        return state.update_one(collection, filter, values, dirty=dirty)
+    getattr(db, collection).update_one(filter, {"$set": values})
+    return True
+
+
+def _inc_one(
+    collection, filter, increments, values=None, conditions=None,
+    on_insert=None
+):
+    state = getattr(LOCAL, "state", None)
+    if state is not None:
+        return state.inc_one(
+            collection, filter, increments, values, conditions, on_insert
+        )
+    update = {"$inc": increments}
+    if values:
+        update["$set"] = values
+    if on_insert:
+        update["$setOnInsert"] = on_insert
+    result = getattr(db, collection).update_one(
+        dict(filter, **(conditions or {})), update,
+        upsert=on_insert is not None
+    )
+    return result.matched_count > 0 or result.upserted_id is not None
+
+
+def _delete_one(collection, filter):
+    state = getattr(LOCAL, "state", None)
+    if state is not None:
+        return state.delete_one(collection, filter)
+    getattr(db, collection).delete_one(filter)
+    return True
+
+
+def _safe(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception as error:
+        slp.LOG.error("%r", error)
+        slp.LOG.debug("traceback data:\n%s", traceback.format_exc())
+        return False
 
 
-def set_legit(filter, value=True):
+def to_units(value, de):
+    "exact integer base units of a token quantity"
+    if hasattr(value, "to_decimal"):
+        value = value.to_decimal()
+    elif isinstance(value, float):
+        value = repr(value)
+    scale, _ = tokens.precision(de)
+    return int(
+        (decimal.Decimal(value) * scale).to_integral_value(
+            decimal.ROUND_HALF_EVEN
+        )
+    )
+
+
+def get_units(document, field, de):
+    """
+    Integer base units of a document amount. Stored `<field>Units` are only
+    read if `integer units` is enabled, they are not updated otherwise.
+    """
+    units = document.get(f"{field}Units", None)
+    if units is not None and slp.JSON.get("integer units", False):
+        return int(units)
+    return to_units(document[field], de)
+
+
+def amounts(de, **units):
+    """
+    Build Decimal128 amounts from integer base units, `<field>Units` values
+    are added if `integer units` is enabled.
+
+    ```python
+    >>> dbapi.amounts(2, balance=1250)
+    {'balance': Decimal128('12.50'), 'balanceUnits': Int64(1250)}
+    ```
+    """
+    result = {}
+    integer_units = slp.JSON.get("integer units", False)
+    _, quantum = tokens.precision(de)
+    for field, value in units.items():
+        result[field] = Decimal128(decimal.Decimal(value) * quantum)
+        if integer_units:
+            result[f"{field}Units"] = Int64(value)
+    return result
+
+
+def _stale_units(document, de, fields):
+    "amounts to set if stored integer base units are missing or stale"
+    units = dict(
+        [f, to_units(document[f], de)] for f in fields if f in document
+    )
+    if all(document.get(f"{f}Units", None) == v for f, v in units.items()):
+        return {}
+    return amounts(de, **units)
+
+
+def migrate_units():
+    """
+    Set integer base units of contracts and wallets from their Decimal128
+    amounts if missing, or stale because `integer units` was disabled for a
+    while.
+    """
+    count = 0
+    for token in db.contracts.find({"type": slp.SLP1}):
+        de = tokens.decimals(token["tokenId"])
+        values = _stale_units(token, de, UNIT_FIELDS)
+        if len(values) or token.get("decimals", None) is None:
+            db.contracts.update_one(
+                {"tokenId": token["tokenId"]},
+                {"$set": dict(values, decimals=de)}
+            )
+            count += 1
+        for wallet in db.slp1.find({"tokenId": token["tokenId"]}):
+            values = _stale_units(wallet, de, ("balance",))
+            if len(values):
+                db.slp1.update_one(
+                    {"tokenId": wallet["tokenId"],
+                     "address": wallet["address"]},
+                    {"$set": values}
+                )
+                count += 1
+    return count
+
+
+def set_legit(contract, value=True):
+    """
+    Set contract legitimity in journal, reccord is matched by its height and
+    index.
+    """
     value = bool(value)
-    db.journal.update_one(filter, {'$set': {"legit": value}})
+    # not seen by journal reads of the block, see slp.state
+    _update_one(
+        "journal", {"height": contract["height"], "index": contract["index"]},
+        {"legit": value}, dirty=False
+    )
+    if isinstance(contract, Contract):
+        contract.legit = value
     return value
 
 
@@ -44,7 +236,7 @@ def add_reccord(height, index, txid, slp_type, emitter, receiver, cost, **kw):
         **kw (keyword args): contract field values.
 
     Returns:
-        bool: `True` if success else `False`.
+        Contract: registered contract if success else `False`.
     """
     fields = dict(
         [k, v] for k, v in kw.items()
@@ -56,23 +248,19 @@ def add_reccord(height, index, txid, slp_type, emitter, receiver, cost, **kw):
         if slp_type.endswith("1"):
             fields.update(mi=kw.get("mi", False))
 
-    if not slp.validate(**fields):
-        slp.LOG.error("field validation did not pass")
-        slp.dumpJson(
-            dict(
-                slp.loadJson(f"unvalidated.{slp_type}", ".json"),
-                **{f"{height}#{index}": fields}
-            ), f"unvalidated.{slp_type}", os.path.join(slp.ROOT, ".json")
-        )
+    invalid = slp.VALIDATOR.check(**fields)
+    if invalid is not None:
+        slp.LOG.error("field validation did not pass: %s, %s", *invalid)
+        add_unvalidated(height, index, txid, slp_type, invalid, fields)
         return False
 
     try:
-        contract = dict(
+        contract = Contract(
             height=height, index=index, txid=txid,
             slp_type=slp_type, emitter=emitter, receiver=receiver,
             cost=cost, legit=None, **fields
         )
-        db.journal.insert_one(contract)
+        db.journal.insert_one(contract.to_bson())
     except Exception as error:
         slp.LOG.error("%r", error)
         slp.LOG.debug("traceback data:\n%s", traceback.format_exc())
@@ -81,51 +269,93 @@ def add_reccord(height, index, txid, slp_type, emitter, receiver, cost, **kw):
         return contract
 
 
+def add_unvalidated(height, index, txid, slp_type, invalid, fields):
+    """
+    Log a contract that did not pass field validation in the `unvalidated`
+    capped collection.
+    """
+    field, reason = invalid
+    try:
+        db.unvalidated.insert_one(
+            dict(
+                blockStamp=f"{height}#{index}", txid=txid,
+                slp_type=slp_type, field=field, reason=reason,
+                fields=fields
+            )
+        )
+    except Exception as error:
+        slp.LOG.error("%r", error)
+        slp.LOG.debug("traceback data:\n%s", traceback.format_exc())
+        return False
+    return True
+
+
+def find_unvalidated(blockStamp):
+    return db.unvalidated.find_one({"blockStamp": blockStamp})
+
+
+def add_rejected(contract):
+    return _safe(_insert_one, "rejected", contract.to_bson())
+
+
 def find_reccord(**filter):
-    return db.journal.find_one(filter)
+    return _find_one("journal", filter)
 
 
 def find_contract(**filter):
-    return db.contracts.find_one(filter)
+    return _find_one("contracts", filter)
 
 
 def find_slp1_wallet(**filter):
-    return db.slp1.find_one(filter)
+    return _find_one("slp1", filter)
 
 
 def find_slp2_wallet(**filter):
-    return db.slp2.find_one(filter)
+    return _find_one("slp2", filter)
+
+
+def find_slp2_wallets(**filter):
+    return _find("slp2", filter)
+
+
+def insert_contract(document):
+    return _safe(_insert_one, "contracts", document)
+
+
+def insert_slp1_wallet(document):
+    return _safe(_insert_one, "slp1", document)
+
+
+def insert_slp2_wallet(document):
+    return _safe(_insert_one, "slp2", document)
+
+
+def delete_slp2_wallet(address, tokenId):
+    return _safe(
+        _delete_one, "slp2", {"address": address, "tokenId": tokenId}
+    )
 
 
 def update_contract(tokenId, values):
-    try:
-        query = {"tokenId": tokenId}
-        update = {"$set": dict(
+    return _safe(
+        _update_one, "contracts", {"tokenId": tokenId}, dict(
             [k, v] for k, v in values.items()
-            if k in "tokenId,height,index,type,name,owner,"
-                    "globalSupply,paused,minted,burned"
-        )}
-        db.contracts.update_one(query, update)
-    except Exception as error:
-        slp.LOG.error("%r", error)
-        slp.LOG.debug("traceback data:\n%s", traceback.format_exc())
-        return False
-    return True
+            if k in "tokenId,height,index,type,name,owner,decimals,"
+                    "globalSupply,paused,minted,burned,exited,"
+                    "globalSupplyUnits,mintedUnits,burnedUnits,exitedUnits"
+        )
+    )
 
 
 def update_slp_wallet(collection, address, tokenId, values):
-    try:
-        query = {"tokenId": tokenId, "address": address}
-        update = {"$set": dict(
+    return _safe(
+        _update_one, collection, {"address": address, "tokenId": tokenId},
+        dict(
             [k, v] for k, v in values.items()
-            if k in "address,tokenId,blockStamp,balance,owner,frozen,metadata"
-        )}
-        getattr(db, collection).update_one(query, update)
-    except Exception as error:
-        slp.LOG.error("%r", error)
-        slp.LOG.debug("traceback data:\n%s", traceback.format_exc())
-        return False
-    return True
+            if k in "address,tokenId,blockStamp,balance,balanceUnits,owner,"
+                    "frozen,metadata"
+        )
+    )
 
 
 def update_slp1_wallet(address, tokenId, values):
@@ -136,51 +366,47 @@ def update_slp2_wallet(address, tokenId, values):
     return update_slp_wallet("slp2", address, tokenId, values)
 
 
-def exchange_slp1_token(tokenId, sender, receiver, qt):
-    # find sender wallet from database
-    _sender = find_slp1_wallet(address=sender, tokenId=tokenId)
-    # get Decimal128 builder according to token id and convert qt to Decimal
-    _decimal128 = slp.DECIMAL128[tokenId]
-    qt = decimal.Decimal(qt)
-
-    if _sender:
-        # find receiver wallet from database
-        _receiver = find_slp1_wallet(address=receiver, tokenId=tokenId)
-        # create it with needed
-        if _receiver is None:
-            db.slp1.insert_one(
-                dict(
-                    address=receiver, tokenId=tokenId, blockStamp="0#0",
-                    balance=_decimal128(0.), owner=False, frozen=False
-                )
-            )
-            new_balance = qt
-        else:
-            new_balance = _receiver["balance"].to_decimal() + qt
-        # first update receiver
-        if update_slp1_wallet(
-            receiver, tokenId, {"balance": _decimal128(new_balance)}
-        ):
-            # if reception is a success, update emitter
-            if update_slp1_wallet(
-                sender, tokenId, {
-                    "balance":
-                        _decimal128(_sender["balance"].to_decimal() - qt)
-                }
-            ):
-                # and return True if success
-                return True
-            else:
-                # if error with sender update get back received token
-                update_slp1_wallet(
-                    receiver, tokenId, {
-                        "balance":
-                            _decimal128(_receiver["balance"].to_decimal() - qt)
-                    }
-                )
-                return False
+def exchange_slp1_token(tokenId, sender, receiver, qt, blockstamp=None):
+    """
+    Move `qt` tokens from sender to receiver wallet with two conditional
+    server-side updates. Sender is debited only if it is not frozen and its
+    balance covers `qt`, receiver wallet is created if needed. If
+    `blockstamp` is given, it is set on both wallets.
 
-    slp.LOG.error(
-        "%s wallet does not exists with contract %s", sender, tokenId
-    )
-    return False
+    Outside a block state no wallet is read. Inside a block state, sender
+    guard is checked client-side on its cached wallet (read once if not
+    cached, `apply_send` already reads it) and again by database, receiver
+    is credited without being read.
+
+    Returns:
+        bool: `True` if success else `False`.
+    """
+    # get token decimal places and convert qt to integer base units
+    de = tokens.decimals(tokenId)
+    units = to_units(qt, de)
+    values = {} if blockstamp is None else {"blockStamp": blockstamp}
+    try:
+        credit = amounts(de, balance=units)
+        debited = _inc_one(
+            "slp1", {"address": sender, "tokenId": tokenId},
+            amounts(de, balance=-units), values,
+            {"frozen": False, "balance": {"$gte": credit["balance"]}}
+        )
+        if not debited:
+            slp.LOG.error(
+                "%s wallet can not send %s of contract %s",
+                sender, qt, tokenId
+            )
+            return False
+        return _inc_one(
+            "slp1", {"address": receiver, "tokenId": tokenId},
+            credit, values, on_insert=dict(
+                [k, v] for k, v in dict(
+                    blockStamp="0#0", owner=False, frozen=False
+                ).items() if k not in values
+            )
+        )
+    except Exception as error:
+        slp.LOG.error("%r", error)
+        slp.LOG.debug("traceback data:\n%s", traceback.format_exc())
+        return False
@@ -0,0 +1,119 @@
+# -*- coding:utf-8 -*-
+
+"""
+Contract handler registry. It maps `(slp_type, tp)` to the function
+applying the contract and is built once: `apply_<tp>` functions of
+`slp.<slp_type>` modules for all configured SLP types, then plugins
+registered under `slp.handlers` entry point group. An entry point has to
+load a callable receiving the `register` function:
+
+```python
+# setup.py of a third party package
+entry_points={"slp.handlers": ["rslp3 = slp3_plugin:setup"]}
+
+# slp3_plugin.py
+def setup(register):
+    register("rslp3", "TRANSFER", apply_transfer)
+```
+
+Contracts with no handler are counted instead of logged one by one.
+"""
+
+import sys
+import slp
+import threading
+import importlib
+import traceback
+import collections
+
+from slp import dbapi
+
+ENTRY_POINT = "slp.handlers"
+HANDLERS = {}
+UNKNOWN = collections.Counter()
+LOCK = threading.Lock()
+
+
+def register(slp_type, tp, handler):
+    HANDLERS[(slp_type, tp.upper())] = handler
+
+
+def register_module(slp_type, module):
+    "register all `apply_<tp>` functions of a module"
+    for name in dir(module):
+        if name.startswith("apply_"):
+            register(slp_type, name[6:], getattr(module, name))
+
+
+def _entry_points():
+    try:
+        from importlib import metadata
+    except ImportError:
+        return []
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return entry_points.select(group=ENTRY_POINT)
+    return entry_points.get(ENTRY_POINT, [])
+
+
+def load():
+    """
+    Build handler registry from SLP modules and plugins.
+    """
+    with LOCK:
+        HANDLERS.clear()
+        for slp_type in slp.JSON.get("slp types", []):
+            name = f"slp.{slp_type[1:]}"
+            try:
+                if name not in sys.modules:
+                    importlib.import_module(name)
+            except ImportError:
+                slp.LOG.info(
+                    "No modules found to handle '%s' contracts", slp_type
+                )
+            else:
+                register_module(slp_type, sys.modules[name])
+        for entry_point in _entry_points():
+            try:
+                entry_point.load()(register)
+            except Exception as error:
+                slp.LOG.error(
+                    "Plugin %s not loaded: %r", entry_point.name, error
+                )
+                slp.LOG.debug("traceback data:\n%s", traceback.format_exc())
+    slp.LOG.info("%d contract handlers registered", len(HANDLERS))
+    return HANDLERS
+
+
+def get(slp_type, tp):
+    "return handler of a contract or None, missing handlers are counted"
+    if not HANDLERS:
+        load()
+    handler = HANDLERS.get((slp_type, tp), None)
+    if handler is None:
+        UNKNOWN[f"{slp_type}/{tp}"] += 1
+    return handler
+
+
+def execute(contract, **options):
+    """
+    Apply a registered contract. Contract is stored in `rejected` collection
+    if handler returns `False`.
+    """
+    handler = get(contract["slp_type"], contract["tp"])
+    if handler is None:
+        return None
+    if contract.get("legit", False) is not None:
+        slp.LOG.error("Contract %s already applied", contract)
+        return None
+    result = handler(contract, **options)
+    if result is False:
+        dbapi.add_rejected(contract)
+    return result
+
+
+def stats():
+    return {
+        "handlers": len(HANDLERS),
+        "unknown": dict(UNKNOWN),
+    }
@@ -7,7 +7,7 @@ import hashlib
 import threading
 import traceback
 
-from slp import node, chain, sync
+from slp import node, chain, sync, transport, aio, tokens
 from usrv import srv
 
 
@@ -36,6 +36,19 @@ def send_peers(**request):
         return list(node.PEERS)
 
 
+# listen requests to /stats endpoint
+@srv.bind("/stats", methods=["GET"])
+def send_stats(**request):
+    if request["method"] == "GET":
+        return {
+            "pipeline": chain.BlockParser.stats(),
+            "transport": transport.stats(),
+            "cache": chain.CACHE.stats() if chain.CACHE is not None else {},
+            "handlers": chain.handlers.stats(),
+            "tokens": tokens.REGISTRY.stats()
+        }
+
+
 class Memory(queue.Queue):
     """
     Queue avoiding double inputs.
@@ -86,7 +99,10 @@ class Messenger(threading.Thread):
         queued = Messenger.MEM.put(request.get("data", {}))
         # memorized
         if queued:
-            Messenger.JOB.put(request)
+            if aio.ENGINE is not None:
+                aio.ENGINE.put(request)
+            else:
+                Messenger.JOB.put(request)
         return queued
 
     @staticmethod
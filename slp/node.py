@@ -5,7 +5,7 @@ import queue
 import threading
 import traceback
 
-from usrv import req
+from slp import transport
 
 #: place to sort discovered peers
 PEERS = set([])
@@ -18,7 +18,7 @@ def broadcast(endpoint, msg, *peers):
     Send message as json string to specific endpoints from a peer selection.
     """
     resp = []
-    if isinstance(endpoint, req.EndPoint):
+    if isinstance(endpoint, transport.EndPoint):
         for peer in peers or PEERS:
             resp.append(endpoint(peer=peer, _jsonify=msg))
     return resp
@@ -28,7 +28,7 @@ def send_message(msg, *peers):
     """
     Post message to `/message` endpoints from a peer selection.
     """
-    return Broadcaster.broadcast(req.POST.message, msg, *peers)
+    return Broadcaster.broadcast(transport.POST.message, msg, *peers)
 
 
 def discovery(*peers, peer=None):
@@ -38,7 +38,7 @@ def discovery(*peers, peer=None):
         "launching a discovery of %s to %s peers",
         msg["hello"]["peer"], len(peers)
     )
-    return Broadcaster.broadcast(req.POST.message, msg, *peers)
+    return Broadcaster.broadcast(transport.POST.message, msg, *peers)
 
 
 def prospect_peers(*peers):
@@ -54,7 +54,7 @@ def prospect_peers(*peers):
     # for all new peer
     for peer in set(peers) - set([me]) - PEERS:
         # ask peer's peer list
-        resp = req.GET.peers(peer=peer)
+        resp = transport.GET.peers(peer=peer)
         # if it answerd
         if resp.get("status", -1) == 200:
             # add peer to peerlist and prospect peer's peer list
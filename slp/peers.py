@@ -0,0 +1,197 @@
+# -*- coding:utf-8 -*-
+
+"""
+Relay peer pool. It tracks exponentially weighted moving averages of latency
+and error rate along with reported height for each relay peer so requests are
+routed to the best one. Slow requests are hedged to the next best peer.
+"""
+
+import time
+import slp
+import threading
+import traceback
+
+from slp import transport
+from concurrent import futures
+
+#: smoothing factor of moving averages
+ALPHA = 0.2
+#: cost in seconds of one block behind the highest peer
+LAG_COST = 0.5
+
+
+class Score:
+    """
+    Health score of a relay peer.
+    """
+
+    __slots__ = ["latency", "errors", "height"]
+
+    def __init__(self, latency=1., errors=0., height=0):
+        self.latency = latency
+        self.errors = errors
+        self.height = height
+
+    def update(self, latency=None, error=False):
+        if latency is not None:
+            self.latency += ALPHA * (latency - self.latency)
+        self.errors += ALPHA * (float(error) - self.errors)
+
+    def cost(self, top):
+        return self.latency * (1 + 10 * self.errors) + \
+            max(0, top - self.height) * LAG_COST
+
+
+def fetch_candidates(peer):
+    """
+    Get api url and height of relays known by a peer.
+    """
+    candidates = {}
+    for candidate in transport.GET.api.peers(
+        peer=peer, orderBy="height:desc", headers=slp.HEADERS
+    ).get("data", []):
+        api_port = candidate.get("ports", {}).get(
+            "@arkecosystem/core-api", -1
+        )
+        if api_port > 0:
+            candidates["http://%s:%s" % (candidate["ip"], api_port)] = \
+                candidate.get("height", 0)
+    return candidates
+
+
+class PeerPool(threading.Thread):
+    """
+    Daemon refreshing relay peers every `peer ttl` seconds.
+    """
+
+    SCORES = {}
+    UPDATED = 0.
+    LOCK = threading.Lock()
+    STOP = threading.Event()
+    EXECUTOR = futures.ThreadPoolExecutor(max_workers=16)
+
+    def __init__(self, *args, **kwargs):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.start()
+        slp.LOG.info("PeerPool %s set", id(self))
+
+    @staticmethod
+    def stop():
+        PeerPool.STOP.set()
+
+    @staticmethod
+    def refresh():
+        api_peer = slp.JSON["api peer"]
+        try:
+            candidates = fetch_candidates(api_peer)
+        except Exception:
+            slp.LOG.error("Can not fetch peers from %s", api_peer)
+            candidates = {}
+        with PeerPool.LOCK:
+            # forget peers no more announced, default api peer is kept
+            for peer in [
+                p for p in PeerPool.SCORES
+                if p not in candidates and p != api_peer
+            ]:
+                PeerPool.SCORES.pop(peer)
+            for peer, height in list(candidates.items())[:20]:
+                PeerPool.SCORES.setdefault(peer, Score()).height = height
+            PeerPool.SCORES.setdefault(api_peer, Score())
+            PeerPool.UPDATED = time.time()
+        slp.LOG.debug("%d relay peers available", len(PeerPool.SCORES))
+        slp.LOG.debug("transport statistics: %s", transport.stats())
+
+    @staticmethod
+    def best(n=1):
+        """
+        Return the `n` best peers. Default api peer is returned while peer
+        pool is empty.
+        """
+        with PeerPool.LOCK:
+            # first caller claims the refresh, others use current scores
+            due = time.time() - PeerPool.UPDATED > \
+                slp.JSON.get("peer ttl", 60)
+            if due:
+                PeerPool.UPDATED = time.time()
+        if due:
+            PeerPool.refresh()
+        with PeerPool.LOCK:
+            if not len(PeerPool.SCORES):
+                return [slp.JSON["api peer"]]
+            top = max(
+                (s.height for s in PeerPool.SCORES.values()), default=0
+            )
+            return sorted(
+                PeerPool.SCORES, key=lambda p: PeerPool.SCORES[p].cost(top)
+            )[:n]
+
+    @staticmethod
+    def report(peer, latency=None, error=False):
+        with PeerPool.LOCK:
+            if peer in PeerPool.SCORES:
+                PeerPool.SCORES[peer].update(latency, error)
+
+    @staticmethod
+    def timed_call(func, peer, *args, **kwargs):
+        start = time.time()
+        try:
+            result = func(*args, peer=peer, **kwargs)
+            # transport errors are returned with a negative status
+            if isinstance(result, dict) and \
+               not 200 <= result.get("status", 0) < 300:
+                raise Exception("Bad status %s" % result.get("status"))
+        except Exception:
+            PeerPool.report(peer, time.time() - start, True)
+            raise
+        else:
+            PeerPool.report(peer, time.time() - start)
+            return result
+
+    @staticmethod
+    def call(func, *args, **kwargs):
+        """
+        Execute `func(*args, peer=peer, **kwargs)` on best peer. If it fails
+        or does not answer within `hedge delay` seconds, a second request is
+        sent to the next best peer. First good answer is returned with the
+        peer that gave it.
+        """
+        delay = slp.JSON.get("hedge delay", 2.)
+        pending, error = {}, None
+        for peer in PeerPool.best(1 + slp.JSON.get("hedged requests", 1)):
+            pending[
+                PeerPool.EXECUTOR.submit(
+                    PeerPool.timed_call, func, peer, *args, **kwargs
+                )
+            ] = peer
+            while len(pending):
+                done, _ = futures.wait(
+                    pending, timeout=delay,
+                    return_when=futures.FIRST_COMPLETED
+                )
+                # peer is slow, hedge the request
+                if not len(done):
+                    break
+                for future in done:
+                    peer = pending.pop(future)
+                    try:
+                        return future.result(), peer
+                    except Exception as exception:
+                        error = exception
+        # no more peer to ask, wait for the pending requests
+        for future in futures.as_completed(pending):
+            try:
+                return future.result(), pending[future]
+            except Exception as exception:
+                error = exception
+        raise error or Exception("No peer available")
+
+    def run(self):
+        PeerPool.STOP.clear()
+        while not PeerPool.STOP.is_set():
+            try:
+                PeerPool.refresh()
+            except Exception as error:
+                slp.LOG.error("%r\n%s", error, traceback.format_exc())
+            PeerPool.STOP.wait(slp.JSON.get("peer ttl", 60))
+        slp.LOG.info("PeerPool %s clean exit", id(self))
@@ -0,0 +1,131 @@
+# -*- coding:utf-8 -*-
+
+"""
+Staged processing with bounded queues. Each stage runs its function with a
+pool of worker threads and emits results in input order to the next stage.
+Because stage queues are bounded, a slow stage blocks the previous ones up to
+the pipeline entry (backpressure).
+"""
+
+import time
+import slp
+import queue
+import threading
+import traceback
+
+
+class Stage:
+    """
+    Pipeline stage. Items are `(sequence, value)` pairs, sequence numbers
+    have to be contiguous and start from 0. If stage function returns `None`
+    or raises an exception, item is dropped.
+    """
+
+    def __init__(self, name, func, workers=1, size=64, output=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(max(1, int(size)))
+        self.output = output
+        self.stop = threading.Event()
+        self.turn = threading.Condition()
+        self.next_seq = 0
+        self.out_seq = 0
+        self.processed = 0
+        self.busy = 0.
+        self.started = time.time()
+
+    def put(self, seq, value):
+        """
+        Push an item in stage queue, block while queue is full.
+        """
+        while not self.stop.is_set():
+            try:
+                self.queue.put((seq, value), timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def start(self):
+        self.stop.clear()
+        self.started = time.time()
+        for i in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        return self
+
+    def _work(self):
+        while not self.stop.is_set():
+            try:
+                seq, value = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            start = time.time()
+            try:
+                result = self.func(value)
+            except Exception as error:
+                slp.LOG.error(
+                    "%s stage error: %r\n%s", self.name, error,
+                    traceback.format_exc()
+                )
+                result = None
+            elapsed = time.time() - start
+            # emit results in sequence order
+            with self.turn:
+                while seq != self.next_seq and not self.stop.is_set():
+                    self.turn.wait(1)
+                # dropped items are not forwarded so output sequence is
+                # numbered here to stay contiguous
+                if self.output is not None and result is not None:
+                    self.output.put(self.out_seq, result)
+                    self.out_seq += 1
+                self.next_seq += 1
+                self.processed += 1
+                self.busy += elapsed
+                self.turn.notify_all()
+
+    def stats(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            "workers": self.workers,
+            "depth": self.queue.qsize(),
+            "size": self.queue.maxsize,
+            "processed": self.processed,
+            "throughput": round(self.processed / elapsed, 3),
+            "busy": round(self.busy / (elapsed * self.workers), 3)
+        }
+
+
+class Pipeline:
+    """
+    Chain of stages built from `(name, func, workers, size)` definitions.
+    """
+
+    def __init__(self, *stages):
+        self.stages = []
+        output = None
+        for name, func, workers, size in reversed(stages):
+            output = Stage(name, func, workers, size, output)
+            self.stages.insert(0, output)
+        self.seq = 0
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop.set()
+
+    def put(self, value):
+        """
+        Push a value at pipeline entry, block while first stage is full.
+        """
+        if self.stages[0].put(self.seq, value):
+            self.seq += 1
+            return True
+        return False
+
+    def stats(self):
+        return dict([stage.name, stage.stats()] for stage in self.stages)
@@ -7,47 +7,113 @@ Improvment of Side Level Protocol smartbridge use.
 
 import slp
 
+import json
 import struct
 import binascii
-
-
-def _pack_varia(*varias):
+import itertools
+import collections
+import concurrent.futures
+
+#: vendor field classification, `kind` is one of `memo`, `json`,
+#: `smartbridge` or `invalid`. `contract` is `False` if not decoded and
+#: `error` holds the decoding error of invalid vendor fields
+VendorField = collections.namedtuple(
+    "VendorField", ["kind", "slp_type", "contract", "error"],
+    defaults=(None,)
+)
+MEMO = VendorField("memo", None, False)
+PREFIXES = {}
+
+
+#: precompiled layouts of the fixed size part of contracts
+BYTE = struct.Struct("<B")
+SLP1_GENESIS = struct.Struct("<BBQ??")
+SLP1_FUNGIBLE = struct.Struct("<B16sQ")
+NON_FUNGIBLE = struct.Struct("<B16s")
+SLP2_GENESIS = struct.Struct("<B?")
+SLP2_ADDMETA = struct.Struct("<B16sB")
+SLP2_VOIDMETA = struct.Struct("<B16s128s")
+#: largest ADDMETA metadata set packed exactly
+EXACT_PACKING = 10
+#: contract types by layout
+SLP1_FUNGIBLE_TYPES = frozenset(["BURN", "SEND", "MINT"])
+SLP1_NON_FUNGIBLE_TYPES = frozenset(
+    ["PAUSE", "RESUME", "NEWOWNER", "FREEZE", "UNFREEZE"]
+)
+SLP2_NON_FUNGIBLE_TYPES = frozenset(
+    ["PAUSE", "RESUME", "NEWOWNER", "AUTHMETA", "REVOKEMETA", "CLONE"]
+)
+#: largest quantity in base units
+MAX_UNITS = 2**63 - 1
+#: longest variable length field, its length byte has to be a valid ascii
+#: character in the smartbridge
+MAX_VARIA = 127
+
+
+def _pack_varia(*varias, buffer=None):
     "pack a list of variable length strings"
-    serial = b""
-    for varia in [v.encode() for v in varias]:
-        len_v = len(varia)
-        serial += struct.pack("<B%ds" % len_v, len_v, varia)
+    serial = bytearray() if buffer is None else buffer
+    for varia in varias:
+        varia = varia.encode()
+        if len(varia) > MAX_VARIA:
+            raise Exception(
+                "Field %r is too long (>%d bytes)" % (varia[:16], MAX_VARIA)
+            )
+        serial += BYTE.pack(len(varia))
+        serial += varia
     return serial
 
 
+def _walk_varia(data, tail=0):
+    "yield variable length strings from data until tail bytes remain"
+    view = memoryview(data)
+    n, end = 0, len(view)
+    while n < end - tail:
+        size = view[n]
+        n += 1
+        if n + size > end:
+            raise struct.error("truncated variable length field")
+        yield str(view[n:n+size], "utf-8")
+        n += size
+
+
 def _unpack_varia(data, *keys):
     "unpack a list of variable length string associated to specific keys"
     result = {}
-    n = 0
-    i = struct.calcsize("<B")
+    values = _walk_varia(data)
     for key in keys:
-        size, = struct.unpack("<B", data[n:n+i])
-        n += i
-        value, = struct.unpack("<%ss" % size, data[n:n+size])
-        result[key] = value.decode()
-        n += size
+        value = next(values, None)
+        if value is None:
+            raise struct.error("missing %s field" % key)
+        result[key] = value
     return result
 
 
 def _unpack_meta(data):
     "unpack metadata from string and build the mapping"
-    result = []
-    n = 0
-    i = struct.calcsize("<B")
-    while n < len(data) - 1:
-        size, = struct.unpack("<B", data[n:n+i])
-        n += i
-        value, = struct.unpack("<%ss" % size, data[n:n+size])
-        result.append(value.decode())
-        n += size
+    # a single trailing byte is ignored as it can not hold a value
+    result = list(_walk_varia(data, tail=1))
     return dict(zip(result[0::2], result[1::2]))
 
 
+def _serialize(slp_type, layout, *values, varia=()):
+    "pack fixed and variable size fields into a smartbridge"
+    fixed = layout.pack(*values).hex()
+    return slp_type + "://" + fixed + _pack_varia(*varia).decode()
+
+
+def _deserialize(data, layout, keys, varia=()):
+    "unpack fixed size fields and variable length ones from data"
+    n = layout.size * 2
+    result = dict(zip(keys, layout.unpack_from(binascii.unhexlify(data[:n]))))
+    if varia:
+        result.update(_unpack_varia(data[n:].encode(), *varia))
+    if "id" in result:
+        result["id"] = result["id"].hex()
+    result["tp"] = slp.TYPES_INPUT[result["tp"]]
+    return result
+
+
 def _match_smartbridge(smartbridge):
     match = slp.REGEXP.match(smartbridge)
     if match is not None:
@@ -58,170 +124,189 @@ def _match_smartbridge(smartbridge):
 
 # -- SLP1 SERIALIZATION --
 def pack_slp1_genesis(de, qt, sy, na, du="", no="", pa=False, mi=False):
-    fixed = struct.pack(
-        "<BBQ??", slp.INPUT_TYPES["GENESIS"],
-        int(de), int(qt), bool(pa), bool(mi)
+    return _serialize(
+        slp.SLP1, SLP1_GENESIS, slp.INPUT_TYPES["GENESIS"],
+        int(de), int(qt), bool(pa), bool(mi), varia=(sy, na, du, no)
     )
-    varia = _pack_varia(sy, na, du, no)
-    return slp.SLP1 + "://" + binascii.hexlify(fixed).decode() + varia.decode()
 
 
 def pack_slp1_fungible(tb, id, qt, no=""):
-    fixed = struct.pack(
-        "<B16sQ", slp.INPUT_TYPES[tb], binascii.unhexlify(id), qt
+    return _serialize(
+        slp.SLP1, SLP1_FUNGIBLE, slp.INPUT_TYPES[tb],
+        binascii.unhexlify(id), qt, varia=(no,)
     )
-    varia = _pack_varia(no)
-    return slp.SLP1 + "://" + binascii.hexlify(fixed).decode() + varia.decode()
 
 
 def pack_slp1_non_fungible(tb, id, no=""):
-    fixed = struct.pack("<B16sQ", slp.INPUT_TYPES[tb], binascii.unhexlify(id))
-    varia = _pack_varia(no)
-    return slp.SLP1 + "://" + binascii.hexlify(fixed).decode() + varia.decode()
+    return _serialize(
+        slp.SLP1, NON_FUNGIBLE, slp.INPUT_TYPES[tb],
+        binascii.unhexlify(id), varia=(no,)
+    )
 
 
 # -- SLP2 SERIALIZATION --
 def pack_slp2_genesis(sy, na, du="", no="", pa=False):
-    fixed = struct.pack("<B?", slp.INPUT_TYPES["GENESIS"], pa)
-    varia = _pack_varia(sy, na, du, no)
-    return slp.SLP2 + "://" + binascii.hexlify(fixed).decode() + varia.decode()
+    return _serialize(
+        slp.SLP2, SLP2_GENESIS, slp.INPUT_TYPES["GENESIS"], pa,
+        varia=(sy, na, du, no)
+    )
 
 
 def pack_slp2_non_fungible(tb, id, no=""):
-    fixed = struct.pack("<B16sQ", slp.INPUT_TYPES[tb], binascii.unhexlify(id))
-    varia = _pack_varia(no)
-    return slp.SLP2 + "://" + binascii.hexlify(fixed).decode() + varia.decode()
+    return _serialize(
+        slp.SLP2, NON_FUNGIBLE, slp.INPUT_TYPES[tb],
+        binascii.unhexlify(id), varia=(no,)
+    )
 
 
-def pack_slp2_addmeta(id, **data):
-    metadata = sorted(data.items(), key=lambda i: len("%s%s" % i))
-    # pack fixed size data
-    fixed = struct.pack(
-        "<B16s", slp.INPUT_TYPES["ADDMETA"], binascii.unhexlify(id)
-    )
-    # smartbridge size - header size - 2*(fixed size + chunk size)
-    spaceleft = 256 - len("_slp2://") - 2*(len(fixed) + 1)
-    # compute the metadata and return a list of smartbridges to contain
-    # all the asked metadata
-    result = []
-    serial = b""
-    remaining = spaceleft
-    for key, value in metadata:
-        if len(key) + len(value) < remaining - 2:
-            ser = _pack_varia(key, value)
-            serial += ser
-            remaining -= len(ser)
+def _addmeta_capacity():
+    # smartbridge size - header size - hex encoded fixed size
+    return 256 - len(slp.SLP2 + "://") - 2 * SLP2_ADDMETA.size
+
+
+def _first_fit_decreasing(items, capacity):
+    "pack `(size, key, value)` items sorted by decreasing size"
+    bins, spaces = [], []
+    for item in items:
+        for i, space in enumerate(spaces):
+            if item[0] <= space:
+                bins[i].append(item)
+                spaces[i] -= item[0]
+                break
         else:
-            result.append(serial)
-            serial = b"" + _pack_varia(key, value)
-            remaining = spaceleft
-    result.append(serial)
+            bins.append([item])
+            spaces.append(capacity - item[0])
+    return bins
+
+
+def _exact_packing(items, capacity, count):
+    "pack items into `count` bins, returns None if not possible"
+    bins = [[] for _ in range(count)]
+    spaces = [capacity] * count
+    left = [sum(item[0] for item in items[i:]) for i in range(len(items))]
+
+    def place(i):
+        if i == len(items):
+            return True
+        if left[i] > sum(spaces):
+            return False
+        size, tried = items[i][0], set()
+        for n, space in enumerate(spaces):
+            # bins with same free space are equivalent
+            if size <= space and space not in tried:
+                tried.add(space)
+                spaces[n] -= size
+                bins[n].append(items[i])
+                if place(i + 1):
+                    return True
+                spaces[n] += size
+                bins[n].pop()
+        return False
+
+    return bins if place(0) else None
+
+
+def plan_slp2_addmeta(**data):
+    """
+    Split metadata into as few ADDMETA smartbridges as possible using first
+    fit decreasing packing. Sets of up to `EXACT_PACKING` items are packed
+    exactly. Returns a list of chunks as lists of `(key, value)` pairs.
+    """
+    capacity = _addmeta_capacity()
+    items = sorted(
+        ((len(_pack_varia(k, v)), k, v) for k, v in data.items()),
+        reverse=True
+    )
+    if len(items) and items[0][0] > capacity:
+        raise Exception(
+            "Metadata %r does not fit in a smartbridge" % items[0][1]
+        )
+    bins = _first_fit_decreasing(items, capacity)
+    if len(items) <= EXACT_PACKING:
+        lower = -(-sum(item[0] for item in items) // capacity)
+        for count in range(lower, len(bins)):
+            exact = _exact_packing(items, capacity, count)
+            if exact is not None:
+                bins = exact
+                break
+    return [[(k, v) for _, k, v in chunk] for chunk in bins]
+
+
+def dry_run_slp2_addmeta(**data):
+    """
+    Report ADDMETA packing of metadata without serializing it: chunk count,
+    bytes used per chunk and fill ratio.
+    """
+    capacity = _addmeta_capacity()
+    used = [
+        sum(len(_pack_varia(k, v)) for k, v in chunk)
+        for chunk in plan_slp2_addmeta(**data)
+    ]
+    return {
+        "chunks": len(used),
+        "capacity": capacity,
+        "used": used,
+        "fill ratio": sum(used) / (capacity * len(used)) if used else 0.
+    }
+
+
+def pack_slp2_addmeta(id, **data):
+    id = binascii.unhexlify(id)
     # build all smartbridges adding chunk number between fixed and serial
     return [
-        slp.SLP2 + "://" + (
-            binascii.hexlify(
-                fixed + struct.pack("<B", result.index(serial) + 1)
-            ).decode() + serial.decode()
-        ) for serial in result
+        slp.SLP2 + "://" + SLP2_ADDMETA.pack(
+            slp.INPUT_TYPES["ADDMETA"], id, chunk
+        ).hex() + _pack_varia(*itertools.chain(*pairs)).decode()
+        for chunk, pairs in enumerate(plan_slp2_addmeta(**data) or [[]], 1)
     ]
 
 
 def pack_slp2_voidmeta(id, tx):
-    fixed = struct.pack(
-        "<B16s128s", slp.INPUT_TYPES["VOIDMETA"],
+    return _serialize(
+        slp.SLP2, SLP2_VOIDMETA, slp.INPUT_TYPES["VOIDMETA"],
         binascii.unhexlify(id), binascii.unhexlify(tx)
     )
-    return slp.SLP2 + "://" + binascii.hexlify(fixed).decode()
 
 
 # -- SLP1 DESERIALIZATION --
 def unpack_slp1_genesis(data):
-    n = int(struct.calcsize("<BBQ??") * 2)
-    fixed = binascii.unhexlify(data[:n])
-    varia = data[n:].encode()
-    result = dict(
-        zip(["tp", "de", "qt", "pa", "mi"], struct.unpack("<BBQ??", fixed)),
-        **_unpack_varia(varia, "sy", "na", "du", "no")
-    )
-    result["tp"] = slp.TYPES_INPUT[result["tp"]]
-    return {slp.SLP1: result}
+    return {slp.SLP1: _deserialize(
+        data, SLP1_GENESIS, ("tp", "de", "qt", "pa", "mi"),
+        ("sy", "na", "du", "no")
+    )}
 
 
 def unpack_slp1_fungible(data):
-    n = int(struct.calcsize("<B16sQ") * 2)
-    fixed = binascii.unhexlify(data[:n])
-    varia = data[n:].encode()
-    result = dict(
-        zip(["tp", "id", "qt"], struct.unpack("<B16sQ", fixed)),
-        **_unpack_varia(varia, "no")
-    )
-    result["id"] = binascii.hexlify(result["id"]).decode()
-    result["tp"] = slp.TYPES_INPUT[result["tp"]]
-    return {slp.SLP1: result}
+    return {slp.SLP1: _deserialize(
+        data, SLP1_FUNGIBLE, ("tp", "id", "qt"), ("no",)
+    )}
 
 
 def unpack_slp1_non_fungible(data):
-    n = int(struct.calcsize("<B16s") * 2)
-    fixed = binascii.unhexlify(data[:n])
-    varia = data[n:].encode()
-    result = dict(
-        zip(["tp", "id"], struct.unpack("<B16s", fixed)),
-        **_unpack_varia(varia, "no")
-    )
-    result["id"] = binascii.hexlify(result["id"]).decode()
-    result["tp"] = slp.TYPES_INPUT[result["tp"]]
-    return {slp.SLP1: result}
+    return {slp.SLP1: _deserialize(data, NON_FUNGIBLE, ("tp", "id"), ("no",))}
 
 
 # -- SLP2 DESERIALIZATION --
 def unpack_slp2_genesis(data):
-    n = int(struct.calcsize("<B?") * 2)
-    fixed = binascii.unhexlify(data[:n])
-    varia = data[n:].encode()
-    result = dict(
-        zip(["tp", "pa"], struct.unpack("<B?", fixed)),
-        **_unpack_varia(varia, "sy", "na", "du", "no")
-    )
-    result["tp"] = slp.TYPES_INPUT[result["tp"]]
-    return {slp.SLP2: result}
+    return {slp.SLP2: _deserialize(
+        data, SLP2_GENESIS, ("tp", "pa"), ("sy", "na", "du", "no")
+    )}
 
 
 def unpack_slp2_non_fungible(data):
-    n = int(struct.calcsize("<B16s") * 2)
-    fixed = binascii.unhexlify(data[:n])
-    varia = data[n:].encode()
-    result = dict(
-        zip(["tp", "id"], struct.unpack("<B16s", fixed)),
-        **_unpack_varia(varia, "no")
-    )
-    result["id"] = binascii.hexlify(result["id"]).decode()
-    result["tp"] = slp.TYPES_INPUT[result["tp"]]
-    return {slp.SLP2: result}
+    return {slp.SLP2: _deserialize(data, NON_FUNGIBLE, ("tp", "id"), ("no",))}
 
 
 def unpack_slp2_addmeta(data):
-    n = int(struct.calcsize("<B16sB") * 2)
-    fixed = binascii.unhexlify(data[:n])
-    varia = data[n:].encode()
-    result = dict(
-        zip(["tp", "id", "ch"], struct.unpack("<B16sB", fixed)),
-        **{"dt": _unpack_meta(varia)}
-    )
-    result["id"] = binascii.hexlify(result["id"]).decode()
-    result["tp"] = slp.TYPES_INPUT[result["tp"]]
+    n = SLP2_ADDMETA.size * 2
+    result = _deserialize(data, SLP2_ADDMETA, ("tp", "id", "ch"))
+    result["dt"] = _unpack_meta(data[n:].encode())
     return {slp.SLP2: result}
 
 
 def unpack_slp2_voidmeta(data):
-    # n = int(struct.calcsize("<B16s128s") * 2)
-    fixed = binascii.unhexlify(data)
-    # varia = data[n:].encode()
-    result = dict(
-        zip(["tp", "tx"], struct.unpack("<B16sB", fixed)),
-        # **_unpack_meta(varia)
-    )
-    result["id"] = binascii.hexlify(result["id"]).decode()
-    result["tx"] = binascii.hexlify(result["tx"]).decode()
+    result = _deserialize(data, SLP2_VOIDMETA, ("tp", "id", "tx"))
+    result["tx"] = result["tx"].hex()
     return {slp.SLP2: result}
 
 
@@ -243,18 +328,18 @@ MAP = {
         "05": unpack_slp2_non_fungible,
         "06": unpack_slp2_non_fungible,
         "09": unpack_slp2_non_fungible,
-        "10": unpack_slp2_addmeta,
-        "11": unpack_slp2_non_fungible,
-        "12": unpack_slp2_voidmeta,
-        "13": unpack_slp2_non_fungible
+        "0a": unpack_slp2_addmeta,
+        "0b": unpack_slp2_voidmeta,
+        "0c": unpack_slp2_non_fungible,
+        "0d": unpack_slp2_non_fungible
     }
 }
 
 
 def pack_slp1(*args, **kwargs):
-    if args[0] in "BURN,SEND,MINT":
+    if args[0] in SLP1_FUNGIBLE_TYPES:
         smartbridge = pack_slp1_fungible(*args, **kwargs)
-    elif args[0] in "PAUSE,RESUME,NEWOWNER,FREEZE,UNFREEZE":
+    elif args[0] in SLP1_NON_FUNGIBLE_TYPES:
         smartbridge = pack_slp1_non_fungible(*args, **kwargs)
     elif args[0] == "GENESIS":
         smartbridge = pack_slp1_genesis(*args[1:], **kwargs)
@@ -266,8 +351,49 @@ def pack_slp1(*args, **kwargs):
         raise Exception("Bad smartbridge size (>256)")
 
 
+def pack_slp1_bulk(tb, id, rows, de=0):
+    """
+    Build BURN, SEND or MINT smartbridges for a single token. Contract type
+    and token id are encoded once for all rows.
+
+    Args:
+        tb (str): `BURN`, `SEND` or `MINT`.
+        id (str): token id as hex.
+        rows (iterable): `(recipient, quantity, note)` rows, note may be
+            omitted.
+        de (int): token decimal places.
+
+    Returns:
+        list: `(recipient, smartbridge)` tuples in rows order.
+    """
+    if tb not in SLP1_FUNGIBLE_TYPES:
+        raise Exception("Unknown contract !")
+    prefix = slp.SLP1 + "://" + NON_FUNGIBLE.pack(
+        slp.INPUT_TYPES[tb], binascii.unhexlify(id)
+    ).hex()
+    # quantity have to be integral and fit int64 in base units
+    limit = MAX_UNITS // 10**int(de)
+    pack_qt = struct.Struct("<Q").pack
+    result = []
+    for row in rows:
+        recipient, qt, no = (tuple(row) + ("",))[:3]
+        if qt % 1 != 0 or not 0 < qt <= limit:
+            raise Exception(f"Bad quantity {qt} for {recipient}")
+        no = no or ""
+        # one byte length is the char itself for short ascii notes
+        if len(no) < 128 and no.isascii():
+            varia = chr(len(no)) + no
+        else:
+            varia = _pack_varia(no).decode()
+        smartbridge = prefix + pack_qt(int(qt)).hex() + varia
+        if len(smartbridge) > 256:
+            raise Exception("Bad smartbridge size (>256)")
+        result.append((recipient, smartbridge))
+    return result
+
+
 def pack_slp2(*args, **kwargs):
-    if args[0] in "PAUSE,RESUME,NEWOWNER,AUTHMETA,REVOKEMETA,CLONE":
+    if args[0] in SLP2_NON_FUNGIBLE_TYPES:
         smartbridge = pack_slp2_non_fungible(*args, **kwargs)
     elif args[0] == "ADDMETA":
         smartbridge = pack_slp2_addmeta(*args[1:], **kwargs)
@@ -283,6 +409,41 @@ def pack_slp2(*args, **kwargs):
         raise Exception("Bad smartbridge size (>256)")
 
 
+def _prefixes():
+    types = tuple(slp.JSON.get("slp types", []))
+    if types not in PREFIXES:
+        PREFIXES[types] = tuple(t + "://" for t in types)
+    return types, PREFIXES[types]
+
+
+def classify(vendorField):
+    """
+    Classify a vendor field and decode it if it is a SLP contract. Non SLP
+    vendor fields are rejected with prefix checks so no exception is raised.
+    """
+    types, prefixes = _prefixes()
+    # serialized contract
+    if vendorField.startswith(prefixes):
+        slp_type, _, data = vendorField.partition("://")
+        try:
+            return VendorField(
+                "smartbridge", slp_type, MAP[slp_type[1:]][data[:2]](data)
+            )
+        except Exception as error:
+            return VendorField("invalid", slp_type, False, "%r" % error)
+    # json contract
+    if vendorField.lstrip()[:1] == "{" and \
+       any(t in vendorField for t in types):
+        try:
+            contract = json.loads(vendorField)
+            (slp_type, fields), = contract.items()
+            assert slp_type in types and isinstance(fields, dict)
+        except Exception as error:
+            return VendorField("invalid", None, False, "%r" % error)
+        return VendorField("json", slp_type, contract)
+    return MEMO
+
+
 def unpack_slp(smartbridge):
     slp_type, data = _match_smartbridge(smartbridge)
     if slp_type not in slp.JSON["slp types"]:
@@ -293,3 +454,51 @@ def unpack_slp(smartbridge):
             )
         )
     return MAP[slp_type[1:]][data[:2]](data)
+
+
+def _unpack_one(vendorField):
+    # decoded the way live ingest does (see chain.read_vendorField)
+    try:
+        kind, slp_type, contract, error = classify(vendorField)
+    except Exception as error:
+        return False, "%r" % error
+    if contract is False:
+        return False, error or f"{kind} vendor field"
+    return contract, None
+
+
+def _unpack_chunk(smartbridges):
+    return [_unpack_one(smartbridge) for smartbridge in smartbridges]
+
+
+def _init_worker(data):
+    slp.configure(data)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def unpack_many(smartbridges, processes=None, chunksize=1000):
+    """
+    Decode an iterable of vendor fields with `classify`, serialized and json
+    contracts are decoded. Returns a list of `(contract, error)` tuples in
+    input order, `contract` is `False` and `error` the reason if item is not
+    a SLP contract. Nothing is raised. If `processes` is set, decoding is
+    spread over a process pool by chunks of `chunksize` items.
+    """
+    if not processes:
+        return _unpack_chunk(smartbridges)
+    result = []
+    with concurrent.futures.ProcessPoolExecutor(
+        processes, initializer=_init_worker, initargs=(dict(slp.JSON),)
+    ) as executor:
+        for chunk in executor.map(
+            _unpack_chunk, _chunks(smartbridges, chunksize)
+        ):
+            result.extend(chunk)
+    return result
@@ -5,34 +5,20 @@ SLP1 contract execution module.
 """
 
 import slp
-import sys
 import traceback
 
-from slp import dbapi
-from bson import Decimal128
+from slp import dbapi, handlers, tokens
 
 
 def manage(contract, **options):
     """
     Dispatch the contract according to its type.
     """
-    try:
-        assert dbapi.db is not None
-        assert contract.get("legit", False) is None
-        result = getattr(
-            sys.modules[__name__], "apply_%s" % contract["tp"].lower()
-        )(contract, **options)
-        if result is False:
-            dbapi.db.rejected.insert_one(contract)
-        return result
-    except AssertionError:
-        slp.LOG.error("Contract %s already applied", contract)
-    except AttributeError:
-        slp.LOG.error("Unknown contract type %s", contract["tp"])
+    return handlers.execute(contract, **options)
 
 
 def apply_genesis(contract, **options):
-    tokenId = contract["id"]
+    tokenId = contract.id
     try:
         # initial quantity should avoid decimal part
         assert contract["qt"] % 1 == 0
@@ -48,34 +34,34 @@ def apply_genesis(contract, **options):
         slp.LOG.error("invalid contract: %s", traceback.format_exc())
         return dbapi.set_legit(contract, False)
     else:
-        # register Decimal128 for accounting precision
-        slp.DECIMAL128[tokenId] = lambda v, de=contract.get('de', 0): \
-            Decimal128(f"%.{de}f" % v)
-        # get the token id associated decimal128 builder and convert qt value
-        _decimal128 = slp.DECIMAL128[tokenId]
-        # convert global sypply as decimal128 and compute minted supply. If
+        # register token decimal places for accounting precision
+        de = contract.get("de", 0)
+        tokens.REGISTRY.set(tokenId, de)
+        # compute global supply and minted supply as integer base units. If
         # token is not mintable, mint global supply on contract creation and
         # credit with global supply on owner wallet creation
-        globalSupply = _decimal128(contract["qt"])
-        minted = _decimal128(0.) if contract.get("mi", False) else globalSupply
+        globalSupply = dbapi.to_units(contract["qt"], de)
+        minted = 0 if contract.get("mi", False) else globalSupply
         # add new contract and new owner wallet into database
         check = [
-            dbapi.db.contracts.insert_one(
+            dbapi.insert_contract(
                 dict(
                     tokenId=tokenId, height=contract["height"],
                     index=contract["index"], type=slp.SLP1,
                     name=contract["na"], symbol=contract["sy"],
-                    owner=contract["emitter"], globalSupply=globalSupply,
+                    owner=contract["emitter"], decimals=de,
                     document=contract["du"], notes=contract.get("no", None),
-                    paused=False, minted=minted, burned=_decimal128(0.),
-                    exited=_decimal128(0.)
+                    paused=False, **dbapi.amounts(
+                        de, globalSupply=globalSupply, minted=minted,
+                        burned=0, exited=0
+                    )
                 )
             ),
-            dbapi.db.slp1.insert_one(
+            dbapi.insert_slp1_wallet(
                 dict(
                     address=contract["emitter"], tokenId=tokenId,
-                    blockStamp=f"{contract['height']}#{contract['index']}",
-                    balance=minted, owner=True, frozen=False
+                    blockStamp=contract.blockstamp, owner=True,
+                    frozen=False, **dbapi.amounts(de, balance=minted)
                 )
             )
         ]
@@ -85,11 +71,11 @@ def apply_genesis(contract, **options):
 
 
 def apply_burn(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # burned quantity should avoid decimal part
-        assert contract["qt"].to_decimal() % 1 == 0
+        assert contract["qt"] % 1 == 0
         # BURN contract have to be sent to master address
         assert contract["receiver"] == slp.JSON["master address"]
         # get contract and wallet
@@ -108,7 +94,10 @@ def apply_burn(contract, **options):
         # check if contract blockstamp higher than wallet one
         assert dbapi.blockstamp_cmp(blockstamp, wallet["blockStamp"])
         # owner may burn only from his balance
-        assert wallet["balance"].to_decimal() >= contract["qt"]
+        de = tokens.decimals(tokenId)
+        qt = dbapi.to_units(contract["qt"], de)
+        balance = dbapi.get_units(wallet, "balance", de)
+        assert balance >= qt
         # return True if assertion only asked (test if contract is valid)
         if options.get("assert_only", False):
             return True
@@ -117,23 +106,20 @@ def apply_burn(contract, **options):
         slp.LOG.error("invalid contract: %s", traceback.format_exc())
         return dbapi.set_legit(contract, False)
     else:
-        # get Decimal128 builder associated to token id
-        _decimal128 = slp.DECIMAL128[tokenId]
         check = [
             # remove quantity from owner wallet
             dbapi.update_slp1_wallet(
                 contract["emitter"], tokenId, dict(
-                    blockStamp=blockstamp, balance=_decimal128(
-                        wallet["balance"].to_decimal() - contract["qt"]
-                    )
+                    blockStamp=blockstamp,
+                    **dbapi.amounts(de, balance=balance - qt)
                 )
             ),
             # update burned quantity on token contract
             dbapi.update_contract(
                 tokenId, dict(
                     height=contract["height"], index=contract["index"],
-                    burned=_decimal128(
-                        token["burned"].to_decimal() + contract["qt"]
+                    **dbapi.amounts(
+                        de, burned=dbapi.get_units(token, "burned", de) + qt
                     )
                 )
             )
@@ -144,14 +130,14 @@ def apply_burn(contract, **options):
 
 
 def apply_mint(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # GENESIS check ---
         reccord = dbapi.find_reccord(id=tokenId, tp="GENESIS")
-        assert reccord is not None and reccord["mintable"] is True
+        assert reccord is not None and reccord.get("mi", False) is True
         # minted quantity should avoid decimal part
-        assert contract["qt"].to_decimal() % 1 == 0
+        assert contract["qt"] % 1 == 0
         # BURN contract have to be sent to master address
         assert contract["receiver"] == slp.JSON["master address"]
         token = dbapi.find_contract(tokenId=tokenId)
@@ -169,12 +155,15 @@ def apply_mint(contract, **options):
         # check if contract blockstamp higher than wallet one
         assert dbapi.blockstamp_cmp(blockstamp, wallet["blockStamp"])
         # owner may mint accourding to global supply limit
+        de = tokens.decimals(tokenId)
+        qt = dbapi.to_units(contract["qt"], de)
+        minted = dbapi.get_units(token, "minted", de)
         current_supply = (
-            token["burned"].to_decimal() + token["minted"].to_decimal() +
-            token["exited"].to_decimal()
+            dbapi.get_units(token, "burned", de) + minted +
+            dbapi.get_units(token, "exited", de)
         )
-        allowed_supply = token["globalSupply"].to_decimal()
-        assert current_supply + contract["qt"] <= allowed_supply
+        allowed_supply = dbapi.get_units(token, "globalSupply", de)
+        assert current_supply + qt <= allowed_supply
         # return True if assertion only asked (test if contract is valid)
         if options.get("assert_only", False):
             return True
@@ -183,14 +172,12 @@ def apply_mint(contract, **options):
         slp.LOG.error("invalid contract: %s", traceback.format_exc())
         return dbapi.set_legit(contract, False)
     else:
-        # get Decimal128 builder associated to token id
-        _decimal128 = slp.DECIMAL128[tokenId]
         check = [
             # add quantity to owner wallet
             dbapi.update_slp1_wallet(
                 contract["emitter"], tokenId, dict(
-                    blockStamp=blockstamp, balance=slp.DECIMAL128[tokenId](
-                        wallet["balance"].to_decimal() + contract["qt"]
+                    blockStamp=blockstamp, **dbapi.amounts(
+                        de, balance=dbapi.get_units(wallet, "balance", de) + qt
                     )
                 )
             ),
@@ -198,9 +185,7 @@ def apply_mint(contract, **options):
             dbapi.update_contract(
                 tokenId, dict(
                     height=contract["height"], index=contract["index"],
-                    minted=_decimal128(
-                        token["minted"].to_decimal() + contract["qt"]
-                    )
+                    **dbapi.amounts(de, minted=minted + qt)
                 )
             )
         ]
@@ -210,8 +195,8 @@ def apply_mint(contract, **options):
 
 
 def apply_send(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         token = dbapi.find_contract(tokenId=tokenId)
         # token exists
@@ -226,7 +211,9 @@ def apply_send(contract, **options):
         # emitter not frozen by owner
         assert emitter.get("frozen", False) is False
         # emitter balance is okay
-        assert emitter["balance"].to_decimal() > contract["qt"]
+        de = tokens.decimals(tokenId)
+        assert dbapi.get_units(emitter, "balance", de) > \
+            dbapi.to_units(contract["qt"], de)
         # check if contract blockstamp higher than emitter one
         assert dbapi.blockstamp_cmp(blockstamp, emitter["blockStamp"])
         # TODO: receiver is a valid address
@@ -239,29 +226,19 @@ def apply_send(contract, **options):
         slp.LOG.error("invalid contract: %s", traceback.format_exc())
         return dbapi.set_legit(contract, False)
     else:
-        check = [
-            dbapi.exchange_slp1_token(
+        # set contract as legit if no errors (exchange_slp1_token returns
+        # False if balances were not updated)
+        return dbapi.set_legit(
+            contract, dbapi.exchange_slp1_token(
                 tokenId, contract["emitter"], contract["receiver"],
-                contract["qt"]
+                contract["qt"], blockstamp
             )
-        ]
-        if check.count(False) == 0:
-            check += [
-                dbapi.update_slp1_wallet(
-                    contract["emitter"], tokenId, {"blockStamp": blockstamp}
-                ),
-                dbapi.update_slp1_wallet(
-                    contract["receiver"], tokenId, {"blockStamp": blockstamp}
-                )
-            ]
-        # set contract as legit if no errors (exchange_slp1_token and
-        # update_slp1_wallet return False if document not added to database)
-        return dbapi.set_legit(contract, check.count(False) == 0)
+        )
 
 
 def apply_newowner(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # TOKEN check ---
         token = dbapi.find_contract(tokenId=tokenId)
@@ -292,7 +269,7 @@ def apply_newowner(contract, **options):
         slp.LOG.error("invalid contract: %s", traceback.format_exc())
         return dbapi.set_legit(contract, False)
     else:
-        blockstamp = f"{contract['height']}#{contract['index']}"
+        blockstamp = contract.blockstamp
         check = [
             dbapi.exchange_slp1_token(
                 tokenId, contract["emitter"], contract["receiver"],
@@ -311,8 +288,8 @@ def apply_newowner(contract, **options):
 
 
 def apply_freeze(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # TOKEN check ---
         token = dbapi.find_contract(tokenId=tokenId)
@@ -354,8 +331,8 @@ def apply_freeze(contract, **options):
 
 
 def apply_unfreeze(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # TOKEN check ---
         token = dbapi.find_contract(tokenId=tokenId)
@@ -397,8 +374,8 @@ def apply_unfreeze(contract, **options):
 
 
 def apply_pause(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # GENESIS check ---
         reccord = dbapi.find_reccord(id=tokenId, tp="GENESIS")
@@ -440,8 +417,8 @@ def apply_pause(contract, **options):
 
 
 def apply_resume(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # GENESIS check ---
         reccord = dbapi.find_reccord(id=tokenId, tp="GENESIS")
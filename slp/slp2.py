@@ -15,10 +15,9 @@ A record in slp2 database is indexed by wallet address and token id.
 """
 
 import slp
-import sys
 import traceback
 
-from slp import dbapi
+from slp import dbapi, handlers
 from slp.serde import _pack_varia
 
 
@@ -74,23 +73,11 @@ def manage(contract, **options):
     """
     Dispatch the contract according to its type.
     """
-    try:
-        assert dbapi.db is not None
-        assert contract.get("legit", False) is None
-        result = getattr(
-            sys.modules[__name__], "apply_%s" % contract["tp"].lower()
-        )(contract, **options)
-        if result is False:
-            dbapi.db.rejected.insert_one(contract)
-        return result
-    except AssertionError:
-        slp.LOG.error("Contract %s already applied", contract)
-    except AttributeError:
-        slp.LOG.error("Unknown contract type %s", contract["tp"])
+    return handlers.execute(contract, **options)
 
 
 def apply_genesis(contract, **options):
-    tokenId = contract["id"]
+    tokenId = contract.id
     try:
         # blockchain transaction amount have to match GENESIS cost
         assert contract["cost"] >= slp.JSON["GENESIS cost"][slp.SLP2]
@@ -106,7 +93,7 @@ def apply_genesis(contract, **options):
     else:
         check = [
             # add new contract
-            dbapi.db.contracts.insert_one(
+            dbapi.insert_contract(
                 dict(
                     tokenId=tokenId, height=contract["height"],
                     index=contract["index"], type=slp.SLP2,
@@ -116,10 +103,10 @@ def apply_genesis(contract, **options):
                 )
             ),
             # add new owner wallet
-            dbapi.db.slp2.insert_one(
+            dbapi.insert_slp2_wallet(
                 dict(
                     address=contract["emitter"], tokenId=tokenId,
-                    blockStamp=f"{contract['height']}#{contract['index']}",
+                    blockStamp=contract.blockstamp,
                     owner=True, metadata=b""
                 )
             )
@@ -130,8 +117,8 @@ def apply_genesis(contract, **options):
 
 
 def apply_newowner(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # TOKEN check ---
         _token_check(tokenId)
@@ -154,7 +141,7 @@ def apply_newowner(contract, **options):
         check = []
         if receiver is None:
             check.append(
-                dbapi.db.slp2.insert_one(
+                dbapi.insert_slp2_wallet(
                     dict(
                         address=contract["receiver"], tokenId=tokenId,
                         blockStamp=blockstamp, owner=True, metadata=b""
@@ -178,8 +165,8 @@ def apply_newowner(contract, **options):
 
 
 def apply_pause(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # GENESIS check ---
         reccord = dbapi.find_reccord(id=tokenId, tp="GENESIS")
@@ -210,8 +197,8 @@ def apply_pause(contract, **options):
 
 
 def apply_resume(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # RESUME contract have to be sent to master address
         assert contract["receiver"] == slp.JSON["master address"]
@@ -238,8 +225,8 @@ def apply_resume(contract, **options):
 
 
 def apply_authmeta(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # TOKEN check ---
         _token_check(tokenId)
@@ -259,7 +246,7 @@ def apply_authmeta(contract, **options):
         return dbapi.set_legit(contract, False)
     else:
         return dbapi.set_legit(
-            contract, dbapi.db.slp2.insert_one(
+            contract, dbapi.insert_slp2_wallet(
                 dict(
                     address=contract["receiver"], tokenId=tokenId,
                     blockStamp=blockstamp, owner=False, metadata=b""
@@ -269,8 +256,8 @@ def apply_authmeta(contract, **options):
 
 
 def apply_addmeta(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # ADDMETA contract have to be sent to master address
         assert contract["receiver"] == slp.JSON["master address"]
@@ -300,8 +287,8 @@ def apply_addmeta(contract, **options):
 
 
 def apply_voidmeta(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # VOIDMETA contract have to be sent to master address
         assert contract["receiver"] == slp.JSON["master address"]
@@ -327,8 +314,8 @@ def apply_voidmeta(contract, **options):
 
 
 def apply_revokemeta(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # TOKEN check ---
         _token_check(tokenId)
@@ -345,13 +332,13 @@ def apply_revokemeta(contract, **options):
         return dbapi.set_legit(contract, False)
     else:
         return dbapi.set_legit(
-            contract, dbapi.db.slp2.delete_one(receiver)
+            contract, dbapi.delete_slp2_wallet(receiver["address"], tokenId)
         )
 
 
 def apply_clone(contract, **options):
-    tokenId = contract["id"]
-    blockstamp = f"{contract['height']}#{contract['index']}"
+    tokenId = contract.id
+    blockstamp = contract.blockstamp
     try:
         # CLONE contract have to be sent to master address
         assert contract["receiver"] == slp.JSON["master address"]
@@ -378,12 +365,12 @@ def apply_clone(contract, **options):
         )
         # get all metadata
         metadata = b""
-        for document in dbapi.db.slp2.find({"tokenId": tokenId}):
+        for document in dbapi.find_slp2_wallets(tokenId=tokenId):
             metadata += document["metadata"]
 
         check = [
             # add new contract
-            dbapi.db.contracts.insert_one(
+            dbapi.insert_contract(
                 dict(
                     tokenId=new_tokenId, height=contract["height"],
                     index=contract["index"], type=slp.SLP2,
@@ -393,10 +380,10 @@ def apply_clone(contract, **options):
                 )
             ),
             # add new owner wallet with the whome metadata
-            dbapi.db.slp2.insert_one(
+            dbapi.insert_slp2_wallet(
                 dict(
                     address=emitter["address"], tokenId=new_tokenId,
-                    blockStamp=f"{contract['height']}#{contract['index']}",
+                    blockStamp=contract.blockstamp,
                     owner=True, metadata=metadata
                 )
             )
@@ -0,0 +1,333 @@
+# -*- coding:utf-8 -*-
+
+"""
+Write-behind state of the block being applied. Contracts and wallets read
+by primary key are kept in memory, contract checks and mutations run
+against them and resulting writes are sent to database once the whole
+block is applied.
+
+collection|primary key
+-|-
+contracts|tokenId
+slp1|address, tokenId
+slp2|address, tokenId
+journal|height, index
+
+Queries on other fields are sent to database and their results are merged
+with documents known by the state. Only writes not matched by primary key
+make a collection dirty, it is flushed before being queried. Journal
+legitimity updates are not seen by reads, so journal queries made while a
+block is applied must not filter on `legit` field (reccords to execute
+again at startup are selected before any block state is opened).
+
+Pending writes are sent as one ordered `bulk_write` per collection inside a
+multi-document transaction, so a block is applied entirely or not at all
+unless a dirty collection is queried. If transaction fails, error is raised
+and nothing is written. If database does not support transactions
+(standalone server) or if `mongo transactions` is set to `false`, bulk
+writes are sent without transaction.
+"""
+
+import slp
+import operator
+import collections
+
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import ConfigurationError, OperationFailure
+
+#: mongo error codes raised when transactions are not available
+NO_TRANSACTION = (20, 263)
+OPERATIONS = {
+    "insert_one": InsertOne,
+    "update_one": UpdateOne,
+    "delete_one": DeleteOne,
+}
+
+#: query operators supported by update guards
+COMPARE = {
+    "$gt": operator.gt, "$gte": operator.ge,
+    "$lt": operator.lt, "$lte": operator.le, "$ne": operator.ne,
+}
+
+KEYS = {
+    "contracts": ("tokenId",),
+    "slp1": ("address", "tokenId"),
+    "slp2": ("address", "tokenId"),
+    "journal": ("height", "index"),
+}
+
+
+def _value(value):
+    return value.to_decimal() if hasattr(value, "to_decimal") else value
+
+
+def _matches(document, conditions):
+    "evaluate equality and comparison conditions on a document"
+    for field, condition in conditions.items():
+        value = _value(document.get(field, None))
+        if isinstance(condition, dict):
+            for op, operand in condition.items():
+                if value is None or not COMPARE[op](value, _value(operand)):
+                    return False
+        elif value != _value(condition):
+            return False
+    return True
+
+
+def _increment(value, step):
+    if hasattr(step, "to_decimal"):
+        # Decimal128 values
+        return type(step)((_value(value) or 0) + step.to_decimal())
+    return (value or 0) + step
+
+
+def _apply(document, filter, update):
+    "apply a $set/$inc update on a copy of a document, None if missing"
+    if document is None:
+        if "$setOnInsert" not in update:
+            return None
+        document = dict(filter, **update["$setOnInsert"])
+    else:
+        document = dict(document)
+    for field, step in update.get("$inc", {}).items():
+        document[field] = _increment(document.get(field, None), step)
+    document.update(update.get("$set", {}))
+    return document
+
+
+class BlockState(object):
+
+    #: None until a transaction has been tried
+    TRANSACTIONS = None
+
+    def __init__(self, db):
+        self.db = db
+        # (collection, *key) -> document or None if not in database
+        self.documents = {}
+        # keys updated without being read -> pending updates, their
+        # document is not known
+        self.blind = {}
+        # pending (collection, operation, args) in execution order
+        self.writes = []
+        self.dirty = set()
+        self.reads = 0
+        self.flushes = 0
+
+    def _key(self, collection, filter):
+        fields = KEYS.get(collection, None)
+        if fields is None or len(filter) != len(fields):
+            return None
+        try:
+            return (collection,) + tuple(filter[field] for field in fields)
+        except KeyError:
+            return None
+
+    def _write(self, collection, operation, *args, dirty=False):
+        self.writes.append((collection, operation, args))
+        if dirty:
+            self.dirty.add(collection)
+
+    def _document(self, key):
+        "known document of a key, read from database if needed"
+        if key not in self.documents:
+            self.reads += 1
+            filter = dict(zip(KEYS[key[0]], key[1:]))
+            document = getattr(self.db, key[0]).find_one(filter)
+            # pending updates are applied on database document
+            for update in self.blind.pop(key, []):
+                document = _apply(document, filter, update)
+            self.documents[key] = document
+        return self.documents[key]
+
+    def find_one(self, collection, filter):
+        key = self._key(collection, filter)
+        if key is None:
+            documents = self.find(collection, filter)
+            return documents[0] if len(documents) else None
+        document = self._document(key)
+        return None if document is None else dict(document)
+
+    def find(self, collection, filter):
+        if collection in self.dirty:
+            self.flush()
+        for key in [k for k in self.blind if k[0] == collection]:
+            self._document(key)
+        self.reads += 1
+        documents = list(getattr(self.db, collection).find(filter))
+        if collection not in KEYS:
+            return documents
+        # database documents are replaced by known ones
+        result, found = [], set()
+        for document in documents:
+            key = self._key(collection, dict(
+                (f, document.get(f)) for f in KEYS[collection]
+            ))
+            found.add(key)
+            document = self.documents.get(key, document)
+            if document is not None and _matches(document, filter):
+                result.append(dict(document))
+        # and documents inserted or updated in the block are added
+        for key, document in self.documents.items():
+            if key[0] == collection and key not in found and \
+               document is not None and _matches(document, filter):
+                result.append(dict(document))
+        return result
+
+    def insert_one(self, collection, document):
+        key = self._key(
+            collection, dict((f, document.get(f)) for f in KEYS[collection])
+        ) if collection in KEYS else None
+        if key is not None:
+            # mimic unique index
+            if self.find_one(
+                collection, dict(zip(KEYS[collection], key[1:]))
+            ) is not None:
+                return False
+            self.documents[key] = dict(document)
+        self._write(
+            collection, "insert_one", dict(document), dirty=key is None
+        )
+        return True
+
+    def update_one(self, collection, filter, values, dirty=True):
+        key = self._key(collection, filter)
+        if key is None:
+            self._write(
+                collection, "update_one", filter, {"$set": values},
+                dirty=dirty
+            )
+            return True
+        document = self.documents.get(key, False)
+        if document is False:
+            if dirty:
+                self.blind.setdefault(key, []).append({"$set": values})
+        elif document is not None:
+            # known documents are replaced, not modified, so savepoints
+            # can share them
+            self.documents[key] = dict(document, **values)
+        self._write(collection, "update_one", filter, {"$set": values})
+        return True
+
+    def inc_one(
+        self, collection, filter, increments, values=None, conditions=None,
+        on_insert=None
+    ):
+        """
+        Increment fields of the document matching `filter` if it also
+        matches `conditions`. Document is created from `filter` and
+        `on_insert` values if it does not exist and `on_insert` is given.
+        Returns `True` if document is updated or created.
+
+        Unconditional upserts of a document not read yet are queued blindly,
+        without reading it. Conditions are evaluated on the known document,
+        read from database if needed, so the result can be returned before
+        flush, and evaluated again by database.
+        """
+        key = self._key(collection, filter)
+        values = values or {}
+        conditions = conditions or {}
+        update = {"$inc": increments}
+        if values:
+            update["$set"] = values
+        if on_insert is not None:
+            update["$setOnInsert"] = on_insert
+        if key is None:
+            self._write(
+                collection, "update_one", dict(filter, **conditions), update,
+                on_insert is not None, dirty=True
+            )
+            return True
+        if key not in self.documents and not conditions and \
+           on_insert is not None:
+            self.blind.setdefault(key, []).append(update)
+        else:
+            document = self._document(key)
+            if document is None and on_insert is None or \
+               document is not None and not _matches(document, conditions):
+                return False
+            self.documents[key] = _apply(document, filter, update)
+        # guard is evaluated again by database
+        self._write(
+            collection, "update_one", dict(filter, **conditions), update,
+            on_insert is not None
+        )
+        return True
+
+    def delete_one(self, collection, filter):
+        key = self._key(collection, filter)
+        if key is not None:
+            self.blind.pop(key, None)
+            self.documents[key] = None
+        self._write(collection, "delete_one", filter, dirty=key is None)
+        return True
+
+    def _bulk_write(self, batches, session=None):
+        for collection, requests in batches.items():
+            getattr(self.db, collection).bulk_write(
+                requests, ordered=True, session=session
+            )
+
+    def _transaction(self, batches):
+        with self.db.client.start_session() as session:
+            session.with_transaction(
+                lambda session: self._bulk_write(batches, session)
+            )
+
+    def savepoint(self):
+        "state to roll back to if a contract fails"
+        return (
+            self.flushes, len(self.writes), dict(self.documents),
+            dict((k, list(v)) for k, v in self.blind.items()),
+            set(self.dirty)
+        )
+
+    def rollback(self, savepoint):
+        """
+        Drop writes queued since savepoint. Raise an exception if they
+        were already flushed.
+        """
+        flushes, count, documents, blind, dirty = savepoint
+        if flushes != self.flushes:
+            raise Exception("writes already flushed, can not roll back")
+        del self.writes[count:]
+        self.documents, self.blind, self.dirty = documents, blind, dirty
+
+    def flush(self):
+        """
+        Send pending writes to database, writes on a collection are executed
+        in order. Errors are raised, transient transaction errors are
+        retried by `with_transaction`.
+        """
+        writes, self.writes = self.writes, []
+        self.flushes += 1
+        batches = collections.OrderedDict()
+        for collection, operation, args in writes:
+            batches.setdefault(collection, []).append(
+                OPERATIONS[operation](*args)
+            )
+        if len(batches) and BlockState.TRANSACTIONS is not False and \
+           slp.JSON.get("mongo transactions", True):
+            try:
+                self._transaction(batches)
+            except (ConfigurationError, OperationFailure) as error:
+                if not isinstance(error, ConfigurationError) and \
+                   error.code not in NO_TRANSACTION:
+                    slp.LOG.error("block transaction failed: %r", error)
+                    raise
+                slp.LOG.info("mongo transactions not available")
+                BlockState.TRANSACTIONS = False
+            except Exception as error:
+                slp.LOG.error("block transaction failed: %r", error)
+                raise
+            else:
+                BlockState.TRANSACTIONS = True
+                batches.clear()
+        # without transaction support writes are sent collection by
+        # collection
+        self._bulk_write(batches)
+        self.dirty.clear()
+        # documents updated blindly are read from database again
+        for key in self.blind:
+            self.documents.pop(key, None)
+        self.blind.clear()
+        return len(writes)
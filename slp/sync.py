@@ -1,13 +1,62 @@
 # -*- coding:utf-8 -*-
 
-import os
 import slp
-import random
 import traceback
 import threading
+import collections
 
 from usrv import req
-from slp import dbapi, chain
+from slp import dbapi, chain, peers, transport, checkpoint
+from concurrent import futures
+
+
+def fetch_page(page, peer, limit=100):
+    """
+    Get a block page from a peer ordered by ascending height.
+    """
+    return transport.GET.api.blocks(
+        peer=peer, page=page, limit=limit, orderBy="height:asc",
+        headers=slp.HEADERS
+    )
+
+
+def search_smartbridges(height_from, height_to, peer, page=1, limit=100):
+    """
+    Get a page of type-0 transactions with a vendor field from a peer using
+    transaction search api over a height range.
+    """
+    return transport.POST.api.transactions.search(
+        peer=peer, page=page, limit=limit, orderBy="timestamp:asc",
+        headers=slp.HEADERS, _jsonify={
+            "type": 0,
+            "vendorField": slp.JSON.get("search vendorField", "%"),
+            "height": {"from": height_from, "to": height_to}
+        }
+    )
+
+
+def get_block(blockId, peer):
+    """
+    Get block header from a peer.
+    """
+    return transport.GET.api.blocks(blockId, peer=peer, headers=slp.HEADERS)
+
+
+def get_height(peer):
+    """
+    Get current blockchain height from a peer, `-1` if not available.
+    """
+    return transport.GET.api.blockchain(peer=peer, headers=slp.HEADERS) \
+        .get("data", {}).get("block", {}).get("height", -1)
+
+
+def is_smartbridge(vendorField):
+    """
+    Check if vendor field looks like a SLP contract.
+    """
+    return any(
+        slp_type in vendorField[:16] for slp_type in slp.JSON["slp types"]
+    )
 
 
 class Processor(threading.Thread):
@@ -30,78 +79,191 @@ class Processor(threading.Thread):
         # subscribe to blockchain webhook if not already done
         if not chain.subscribed():
             chain.subscribe()
-        # load last processing mark if any
-        markfolder = os.path.join(slp.ROOT, ".json")
-        markname = f"{slp.JSON['database name']}.mark"
-        mark = slp.loadJson(markname, markfolder)
-        # get last good peer if any else choose a random one
-        peers = chain.select_peers()
-        peer = mark.get("peer", random.choice(peers))
-        # determine where to start
-        start_height = max(
-            min(slp.JSON["milestones"].values()),
-            mark.get("last parsed block", 0)
+        # load last applied block height if any
+        applied = checkpoint.load()
+        # reccords registered in journal after last applied block were not
+        # executed, they have to be before sync restarts
+        chain.manage_contracts(
+            dbapi.db.journal.find(
+                {"legit": None, "height": {"$gt": applied}}
+            ).sort([("height", 1), ("index", 1)])
         )
+        # determine where to start
+        start_height = max(min(slp.JSON["milestones"].values()), applied)
         last_reccord = list(
             dbapi.db.journal.find().sort("height", -1).limit(1)
         )
         if len(last_reccord):
             start_height = max(last_reccord[0]["height"], start_height)
-        block_per_page = 100
-        page = start_height // block_per_page - 1
 
         slp.LOG.info("Start downloading blocks from height %s", start_height)
-        last_parsed = start_height
+        self.last_parsed = start_height
 
         # controled infinite loop
+        peers.PeerPool()
         chain.BlockParser()
         Processor.STOP.clear()
+        if slp.JSON.get("sync mode", "blocks") == "search":
+            self.search_blocks(start_height)
+        else:
+            self.walk_pages(start_height)
+
+        req.EndPoint.timeout = timeout
+        slp.LOG.info("Processor %d task exited", id(self))
+
+    def queue_blocks(self, blocks):
+        """
+        Push blocks into BlockParser queue.
+        """
+        for block in blocks:
+            chain.BlockParser.JOB.put(block)
+            self.last_parsed = block["height"]
+
+    def walk_pages(self, start_height):
+        """
+        Walk block pages from start height with a look-ahead window.
+        """
+        block_per_page = 100
+        page = start_height // block_per_page - 1
+        # number of page requests kept in flight across peers
+        prefetch = max(1, int(slp.JSON.get("prefetch pages", 4)))
+        # look-ahead window is a FIFO of (page, future) so it also acts as
+        # reorder buffer: pages are consumed in strict ascending order
+        # whatever the order requests are answered. Each request is routed
+        # to the best peer by the peer pool
+        executor = futures.ThreadPoolExecutor(max_workers=prefetch)
+        window = collections.deque()
+        next_page = page
+        end_reached = False
+        current = None
+
         while not Processor.STOP.is_set():
             try:
+                # fill the look-ahead window
+                while not end_reached and len(window) < prefetch:
+                    window.append((next_page, executor.submit(
+                        peers.PeerPool.call, fetch_page, next_page,
+                        limit=block_per_page
+                    )))
+                    next_page += 1
 
-                blocks = req.GET.api.blocks(
-                    peer=peer, page=page, limit=block_per_page,
-                    orderBy="height:asc", headers=slp.HEADERS
-                )
+                page, future = current = window.popleft()
+                try:
+                    blocks, peer = future.result()
+                except Exception as error:
+                    slp.LOG.error("%r", error)
+                    blocks, peer = {}, None
 
                 if blocks.get("status", False) == 200:
-                    mark = {"peer": peer}
-                    next_page = blocks.get("meta", {}).get("next", False)
+                    next_ = blocks.get("meta", {}).get("next", False)
 
                     blocks = [
                         b for b in blocks.get("data", [])
                         if b["transactions"] > 0 and
-                           b["height"] > last_parsed
+                           b["height"] > self.last_parsed
                     ]
 
                     slp.LOG.info(
                         "Fetching %d blocks from page %d", len(blocks), page
                     )
+                    self.queue_blocks(blocks)
 
-                    if len(blocks):
-                        for block in blocks:
-                            chain.BlockParser.JOB.put(block)
-                            mark["last parsed block"] = block["height"]
-                            slp.dumpJson(mark, markname, markfolder)
-                            last_parsed = block["height"]
-
-                    if next_page is None:
+                    if next_ is None:
                         slp.LOG.info("End of block pages reached")
+                        # pages prefetched beyond the end are dropped
+                        end_reached = True
+                        for _, pending in window:
+                            pending.cancel()
+                        window.clear()
                         Processor.stop()
-                    else:
-                        page += 1
 
                 else:
-                    slp.LOG.info("No block from %s", peer)
-                    if peer in peers:
-                        peers.remove(peer)
-                    if len(peers) <= 1:
-                        peers = chain.select_peers()
-                    peer = random.choice(peers)
+                    slp.LOG.info("No block found for page %d", page)
+                    # request the page again in head of window so order is
+                    # kept
+                    window.appendleft((page, executor.submit(
+                        peers.PeerPool.call, fetch_page, page,
+                        limit=block_per_page
+                    )))
+                current = None
 
             except Exception as error:
                 slp.LOG.error("%r", error)
                 slp.LOG.debug("traceback data:\n%s", traceback.format_exc())
+                # page have to be fetched again
+                if current is not None:
+                    page, _ = current
+                    window.appendleft((page, executor.submit(
+                        peers.PeerPool.call, fetch_page, page,
+                        limit=block_per_page
+                    )))
+                    current = None
 
-        req.EndPoint.timeout = timeout
-        slp.LOG.info("Processor %d task exited", id(self))
+        executor.shutdown(wait=False)
+
+    def search_blocks(self, start_height):
+        """
+        Walk height ranges from start height and only fetch blocks containing
+        SLP smartbridges found with transaction search api.
+        """
+        # height range covered by one search
+        span = max(1, int(slp.JSON.get("search range", 10000)))
+        height_from = start_height + 1
+        call = peers.PeerPool.call
+
+        while not Processor.STOP.is_set():
+            try:
+                height, peer = call(get_height)
+                if height < 0:
+                    slp.LOG.info("No height from %s", peer)
+                    peers.PeerPool.report(peer, error=True)
+                    continue
+                if height_from > height:
+                    slp.LOG.info("Blockchain height %s reached", height)
+                    Processor.stop()
+                    continue
+                height_to = min(height, height_from + span - 1)
+
+                # gather ids of blocks containing SLP smartbridges
+                block_ids, page, next_ = [], 1, True
+                while next_ is not None:
+                    resp, peer = call(
+                        search_smartbridges, height_from, height_to,
+                        page=page
+                    )
+                    # range is searched again if a page is missing
+                    if resp.get("status") != 200:
+                        raise Exception("Transaction search failed")
+                    for tx in resp.get("data", []):
+                        if is_smartbridge(tx.get("vendorField", "")) and \
+                           tx["blockId"] not in block_ids:
+                            block_ids.append(tx["blockId"])
+                    next_ = resp.get("meta", {}).get("next", None)
+                    page += 1
+
+                # get block headers so BlockParser can check transaction
+                # count and sort them by height
+                blocks = []
+                for blockId in block_ids:
+                    resp, peer = call(get_block, blockId)
+                    block = resp.get("data", {})
+                    if block == {}:
+                        raise Exception("Block %s not found" % blockId)
+                    blocks.append(block)
+                blocks = sorted(
+                    [b for b in blocks if b["height"] > self.last_parsed],
+                    key=lambda b: b["height"]
+                )
+
+                slp.LOG.info(
+                    "Fetching %d blocks from height %d to %d",
+                    len(blocks), height_from, height_to
+                )
+                self.queue_blocks(blocks)
+                # whole range is parsed
+                self.last_parsed = max(self.last_parsed, height_to)
+                height_from = height_to + 1
+
+            except Exception as error:
+                slp.LOG.error("%r", error)
+                slp.LOG.debug("traceback data:\n%s", traceback.format_exc())
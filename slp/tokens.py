@@ -0,0 +1,95 @@
+# -*- coding:utf-8 -*-
+
+"""
+Token decimals registry. Decimal places of SLP1 tokens are read from
+`contracts` collection on first use and kept in a bounded cache, least
+recently used tokens are evicted first. Tokens created before decimals
+were stored on contracts fall back to their GENESIS journal entry.
+"""
+
+import slp
+import decimal
+import threading
+import collections
+
+#: decimal places allowed by validation
+MAX_DECIMALS = 8
+#: decimal places -> (base units per token, Decimal quantum)
+PRECISION = tuple(
+    (10 ** de, decimal.Decimal(1).scaleb(-de))
+    for de in range(MAX_DECIMALS + 1)
+)
+
+
+class TokenRegistry(object):
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        # token id -> decimal places, from least to most recently used
+        self.entries = collections.OrderedDict()
+
+    def _load(self, tokenId):
+        # read through dbapi so tokens created in the block being applied
+        # are found
+        from slp import dbapi
+        token = dbapi.find_contract(tokenId=tokenId)
+        if token is None:
+            return None
+        de = token.get("decimals", None)
+        if de is None:
+            # token id is unique and its contract exists so GENESIS was
+            # applied, legit field is not filtered because journal reads do
+            # not see legitimity set in the block being applied
+            genesis = dbapi.find_reccord(id=tokenId, tp="GENESIS") or {}
+            de = genesis.get("de", 0)
+        return de
+
+    def set(self, tokenId, de):
+        with self.lock:
+            self.entries[tokenId] = de
+            self.entries.move_to_end(tokenId)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def decimals(self, tokenId):
+        """
+        Return decimal places of a token, raise `KeyError` if token does not
+        exist.
+        """
+        with self.lock:
+            de = self.entries.get(tokenId, None)
+            if de is not None:
+                self.entries.move_to_end(tokenId)
+                self.hits += 1
+                return de
+            self.misses += 1
+        de = self._load(tokenId)
+        if de is None:
+            raise KeyError(tokenId)
+        self.set(tokenId, de)
+        return de
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries), "size": self.size,
+                "hits": self.hits, "misses": self.misses
+            }
+
+
+REGISTRY = TokenRegistry()
+
+
+def decimals(tokenId):
+    return REGISTRY.decimals(tokenId)
+
+
+def precision(de):
+    "base units per token and Decimal quantum of a decimal places count"
+    return PRECISION[de]
@@ -0,0 +1,191 @@
+# -*- coding:utf-8 -*-
+
+"""
+Keep-alive HTTP transport used to request relays and slp nodes. Connections
+are pooled per host so requests reuse sockets instead of opening a new one
+each time. Endpoints are built the same way as `usrv.req` ones:
+
+```python
+>>> from slp import transport
+>>> transport.GET.api.blocks(blockId, "transactions", peer=peer, page=1)
+```
+"""
+
+import json
+import queue
+import threading
+import http.client
+import urllib.parse
+
+#: maximum idle connections kept per host
+POOL_SIZE = 8
+#: socket timeout in seconds
+TIMEOUT = 30
+#: retries allowed per request sent, retry budget can not exceed RETRY_MAX
+RETRY_RATIO = 0.1
+RETRY_MAX = 10.
+
+POOLS = {}
+LOCK = threading.Lock()
+STATS = {
+    "requests": 0, "created": 0, "reused": 0, "retries": 0, "errors": 0,
+    "budget": RETRY_MAX
+}
+
+
+class ConnectionPool(queue.LifoQueue):
+    """
+    Idle connections to a single host.
+    """
+
+    def __init__(self, scheme, netloc):
+        queue.LifoQueue.__init__(self, POOL_SIZE)
+        self.cls = http.client.HTTPSConnection if scheme == "https" \
+            else http.client.HTTPConnection
+        self.netloc = netloc
+
+    def acquire(self):
+        try:
+            conn = self.get_nowait()
+        except queue.Empty:
+            _count("created")
+            return self.cls(self.netloc, timeout=TIMEOUT), False
+        else:
+            _count("reused")
+            return conn, True
+
+    def release(self, conn):
+        try:
+            self.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+def _count(key, value=1):
+    with LOCK:
+        STATS[key] += value
+
+
+def _spend_retry():
+    with LOCK:
+        if STATS["budget"] >= 1:
+            STATS["budget"] -= 1
+            STATS["retries"] += 1
+            return True
+        return False
+
+
+def get_pool(peer):
+    scheme, netloc = urllib.parse.urlsplit(peer)[:2]
+    with LOCK:
+        return POOLS.setdefault(
+            (scheme, netloc), ConnectionPool(scheme, netloc)
+        )
+
+
+def stats():
+    """
+    Return transport statistics with the idle connection count per host.
+    """
+    with LOCK:
+        result = dict(STATS)
+        result["idle"] = dict(
+            ["%s://%s" % key, pool.qsize()] for key, pool in POOLS.items()
+        )
+    return result
+
+
+def request(method, peer, path, params={}, body=None, headers={}):
+    """
+    Send an HTTP request over a pooled connection. Response is returned as
+    a dict containing response status. If JSON response is not a mapping, it
+    is stored in `result` field.
+    """
+    pool = get_pool(peer)
+    url = "/" + path.strip("/")
+    if len(params):
+        url += "?" + urllib.parse.urlencode(params)
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    headers = dict({"Connection": "keep-alive"}, **headers)
+    if data is not None:
+        headers["Content-Type"] = "application/json"
+
+    with LOCK:
+        STATS["requests"] += 1
+        STATS["budget"] = min(RETRY_MAX, STATS["budget"] + RETRY_RATIO)
+
+    while True:
+        conn, reused = pool.acquire()
+        sent = False
+        try:
+            conn.request(method, url, body=data, headers=headers)
+            sent = True
+            resp = conn.getresponse()
+            raw = resp.read()
+        except Exception as error:
+            conn.close()
+            # a request without side effect can be sent again. Others only
+            # if not sent or if a reused connection was closed by remote
+            # host before answering anything
+            if (
+                method in ["GET", "HEAD"] or not sent or reused and
+                isinstance(error, http.client.RemoteDisconnected)
+            ) and _spend_retry():
+                continue
+            _count("errors")
+            return {"status": -1, "error": "%r" % error}
+        else:
+            if resp.will_close:
+                conn.close()
+            else:
+                pool.release(conn)
+            break
+
+    return load_response(resp.status, raw)
+
+
+def load_response(status, raw):
+    """
+    Build response dict from HTTP status and raw body.
+    """
+    try:
+        data = json.loads(raw.decode("utf-8")) if len(raw) else {}
+    except Exception:
+        data = {"raw": raw.decode("latin-1")}
+    if not isinstance(data, dict):
+        data = {"result": data}
+    data.setdefault("status", status)
+    return data
+
+
+class EndPoint(object):
+    """
+    Endpoint builder: attribute access and call arguments build the url
+    path. `peer` and `headers` keywords are used for the request, `_jsonify`
+    is sent as JSON body and other keywords are sent as query string. For
+    `POST` and `PUT` without `_jsonify`, keywords are sent as JSON body.
+    """
+
+    def __init__(self, method, path=""):
+        self.method = method
+        self.path = path
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return EndPoint(self.method, self.path + "/" + attr)
+
+    def __call__(self, *path, peer=None, headers={}, _jsonify=None, **kw):
+        path = "/".join([self.path] + [str(p) for p in path])
+        if _jsonify is None and self.method in ["POST", "PUT"]:
+            _jsonify, kw = kw, {}
+        return request(
+            self.method, peer, path, params=kw, body=_jsonify,
+            headers=headers
+        )
+
+
+GET = EndPoint("GET")
+POST = EndPoint("POST")
+PUT = EndPoint("PUT")
+DELETE = EndPoint("DELETE")